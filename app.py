@@ -1,96 +1,97 @@
+import logging
+import os
+import time
 import streamlit as st
 import pandas as pd
-import plotly.express as px
-import requests
-from metric_definitions import metric_definitions
+from cityscore import current_scores, downsample, instrument, rollups
+from cityscore.definitions import pretty_names
+
+# plotly, pyarrow and requests are only imported by the pages that need them
 
 
 # FUNCTIONS
 
+DATA_MAX_AGE = 60 * 60
+# only read the snapshots published to the disk cache by `python -m cityscore`,
+# checking for new ones every SNAPSHOT_POLL_INTERVAL seconds
+SNAPSHOTS_ONLY = bool(os.environ.get("CITYSCORE_SNAPSHOTS_ONLY"))
+SNAPSHOT_POLL_INTERVAL = 60
+# show the performance panel at the bottom of every page
+DEBUG = bool(os.environ.get("CITYSCORE_DEBUG"))
+# serve Prometheus metrics on this port, if set
+METRICS_PORT = os.environ.get("CITYSCORE_METRICS_PORT")
 
-@st.cache(allow_output_mutation=True, ttl=60 * 60, max_entries=7)
-def fetch_data(resource_id):
-    """
-    Fetch all data from Analyze Boston for a given resource id
-    """
-    # define urls
-    boston_api_root = "https://data.boston.gov"
-    search_endpont = "/api/3/action/datastore_search"
-    limit = 32000
-    full_url = (
-        f"{boston_api_root}{search_endpont}?resource_id={resource_id}&limit={limit}"
-    )
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("cityscore.app")
 
-    # initial request
-    r = requests.get(full_url)
-    total_records = r.json()["result"]["total"]
-    all_records = r.json()["result"]["records"]
-    fields = [c["id"] for c in r.json()["result"]["fields"]]
 
-    # page through
-    while len(all_records) < total_records:
-        next_url = r.json()["result"]["_links"]["next"]
-        r = requests.get(boston_api_root + next_url)
-        all_records.extend(r.json()["result"]["records"])
+@st.cache(allow_output_mutation=True)
+def memory_cache():
+    """
+    Bounded cache of derived data shared by every session, keyed on the
+    version token of the data it was derived from
+    """
+    from cityscore.memory_cache import MemoryCache
 
-    # convert to dataframe and fix column order
-    df = pd.DataFrame(all_records)
-    df = df.reindex(columns=fields)
-    return df
+    return MemoryCache()
 
 
-@st.cache(allow_output_mutation=True)
-def enhance_dataframe(df):
+def dataset_refresher(resource_id):
     """
-    Fix datatypes and add features for the CityScore Full Metrics dataset
+    Background worker keeping the data for a resource up to date, shared by
+    every session. Page runs read the last published version and never wait
+    on Analyze Boston, except before the very first version is ready
     """
-    # set id as index
-    df = df.set_index("_id")
-    # fix datatypes
-    df["score_calculated_ts"] = pd.to_datetime(df["score_calculated_ts"])
-    df["target"] = pd.to_numeric(df["target"], errors="coerce")
-    df["day_score"] = pd.to_numeric(df["day_score"], errors="coerce")
-    df["day_numerator"] = pd.to_numeric(df["day_numerator"], errors="coerce")
-    df["day_denominator"] = pd.to_numeric(df["day_denominator"], errors="coerce")
-    df["week_score"] = pd.to_numeric(df["week_score"], errors="coerce")
-    df["week_numerator"] = pd.to_numeric(df["week_numerator"], errors="coerce")
-    df["week_denominator"] = pd.to_numeric(df["week_denominator"], errors="coerce")
-    df["month_score"] = pd.to_numeric(df["month_score"], errors="coerce")
-    df["month_numerator"] = pd.to_numeric(df["month_numerator"], errors="coerce")
-    df["month_denominator"] = pd.to_numeric(df["month_denominator"], errors="coerce")
-    df["quarter_score"] = pd.to_numeric(df["quarter_score"], errors="coerce")
-    df["quarter_numerator"] = pd.to_numeric(df["quarter_numerator"], errors="coerce")
-    df["quarter_denominator"] = pd.to_numeric(
-        df["quarter_denominator"], errors="coerce"
-    )
-    df["latest_score_flag"] = df["latest_score_flag"].astype(int).astype(bool)
-    # add date indicator columns
-    df["day"] = df["score_calculated_ts"].dt.date - pd.DateOffset(days=1)
-    df["week"] = df["day"].dt.to_period("W-SAT").dt.start_time - pd.DateOffset(weeks=1)
-    df["month"] = df["day"].dt.to_period("M").dt.to_timestamp() - pd.DateOffset(
-        months=1
+    from cityscore.resources import build_resource
+    from cityscore.refresher import shared_refresher
+
+    cache = memory_cache()
+    return shared_refresher(
+        resource_id,
+        lambda previous, max_age: build_resource(
+            resource_id, previous, max_age, cache, sync=not SNAPSHOTS_ONLY
+        ),
+        interval=SNAPSHOT_POLL_INTERVAL if SNAPSHOTS_ONLY else DATA_MAX_AGE,
     )
-    df["quarter"] = df["day"].dt.to_period("Q").dt.to_timestamp() - pd.DateOffset(1)
-    df["year"] = df["day"].dt.year
-    return df
 
 
-@st.cache(allow_output_mutation=True)
-def df_to_csv(df):
-    return df.to_csv().encode("utf-8")
+def cache_metrics():
+    """
+    Values reported alongside the counters and spans: the memory cache's
+    counters, and its size as gauges
+    """
+    counters = {
+        f"memory_cache_{key}": value for key, value in memory_cache().stats().items()
+    }
+    # the size of the cache goes up and down; everything else only increases
+    gauges = {
+        name: counters.pop(name)
+        for name in [
+            "memory_cache_entries",
+            "memory_cache_bytes",
+            "memory_cache_max_bytes",
+        ]
+    }
+    return {"counters": counters, "gauges": gauges}
 
 
-prettify_names = {m["metric_name"]: m["metric_pretty"] for m in metric_definitions}
-metric_pretty_list = [m["metric_pretty"] for m in metric_definitions]
+def derived(name, build):
+    """
+    Get something derived from both the data and the metric definitions,
+    built once per version of each
+    """
+    return memory_cache().get((name, dataset["etag"], definitions["etag"]), build)
+
 
 # set up app
 st.set_page_config(layout="wide")
 st.title("City of Boston: CityScore")
-
-# fetch data and fix datatypes
+if METRICS_PORT:
+    instrument.serve_metrics(int(METRICS_PORT), cache_metrics)
+# spans and counters of this script run, also added to the process-wide ones
+run_metrics = instrument.Metrics(parent=instrument.metrics)
 cityscore_fullmetrics = "dd657c02-3443-4c00-8b29-56a40cfe7ee4"
-df = fetch_data(cityscore_fullmetrics)
-df = enhance_dataframe(df)
+cityscore_definitions = "db7b8b86-5c35-45b2-9276-5a6527ae6edc"
 
 # set up sidebar nav
 with st.sidebar:
@@ -106,7 +107,32 @@ with st.sidebar:
         ],
     )
 
+# fetch data and fix datatypes, unless the page is static
+dataset = None
+if menu != "About this App":
+    with run_metrics.span("dataset.get"):
+        # start both refreshers before waiting on either, so they load together
+        refreshers = [
+            dataset_refresher(resource_id)
+            for resource_id in [cityscore_fullmetrics, cityscore_definitions]
+        ]
+        dataset, definitions = [refresher.get() for refresher in refreshers]
+    df = dataset["df"]
+    scores = dataset["scores"]
+    aggs = dataset["aggregates"]
+    # every metric with data, with its definition, logic and target
+    metric_table = derived(
+        "metric_table",
+        lambda: definitions["definitions"].join(aggs["metric_info"], how="inner"),
+    )
+    metric_names = derived(
+        "metric_names",
+        lambda: pd.Series(metric_table.index, index=metric_table["metric_pretty"]),
+    )
+
 st.header(menu)
+page_span = "page." + menu.lower().replace(" ", "_")
+page_start = time.perf_counter()
 if menu == "About this App":
     st.markdown(
         """
@@ -133,107 +159,26 @@ if menu == "About this App":
     """
     )
 elif menu == "Current Scores":
-    df_current_scores = df[df["latest_score_flag"] == True]
-    df_current_scores = (
-        df_current_scores[
-            [
-                "metric_name",
-                "score_calculated_ts",
-                "day",
-                "day_score",
-                "week",
-                "week_score",
-                "month",
-                "month_score",
-                "quarter",
-                "quarter_score",
-            ]
-        ]
-        .reset_index(drop=True)
-        .sort_values(by=["metric_name"])
+    # built once per version of the data, so reruns only send it out
+    view = derived(
+        "current_scores",
+        lambda: current_scores.build_view(
+            scores, aggs["period_averages"], definitions["definitions"]
+        ),
     )
-    current_day = df_current_scores["day"].max()
-    current_week = df_current_scores["week"].max()
-    current_month = df_current_scores["month"].max()
-    current_quarter = df_current_scores["quarter"].max()
-
-    current_day_score = df[df["day"] == current_day].day_score.mean()
-    current_week_score = df[df["week"] == current_week].week_score.mean()
-    current_month_score = df[df["month"] == current_month].month_score.mean()
-    current_quarter_score = df[df["quarter"] == current_quarter].quarter_score.mean()
-
-    df_previous_day = df[df["day"] == (current_day - pd.DateOffset(days=1))][
-        ["metric_name", "day_score", "day"]
-    ].drop_duplicates()
-    previous_day_score = df_previous_day.day_score.mean()
-    df_previous_week = df[df["week"] == (current_week - pd.DateOffset(weeks=1))][
-        ["metric_name", "week_score", "week"]
-    ].drop_duplicates()
-    previous_week_score = df_previous_week.week_score.mean()
-    df_previous_month = df[df["month"] == (current_month - pd.DateOffset(months=1))][
-        ["metric_name", "month_score", "month"]
-    ].drop_duplicates()
-    previous_month_score = df_previous_month.month_score.mean()
-    df_previous_quarter = df[
-        df["quarter"] == (current_quarter - pd.DateOffset(months=3))
-    ][["metric_name", "quarter_score", "quarter"]].drop_duplicates()
-    previous_quarter_score = df_previous_quarter.quarter_score.mean()
 
     with st.container():
         st.markdown(
             "Note: Scores correspond to these date periods (the previous day, week, month, quarter)"
         )
-        col1, col2, col3, col4 = st.columns([2, 2, 1, 1])
-        col1.metric("Day", current_day.strftime("%b %d, %Y"))
-        col2.metric("Week of", current_week.strftime("%b %d, %Y"))
-        col3.metric("Month", current_month.month)
-        col4.metric("Quarter", current_quarter.quarter)
-        col1.metric(
-            "Avg Score",
-            round(current_day_score, 2),
-            round(current_day_score - previous_day_score, 2),
-        )
-        col2.metric(
-            "Avg Score",
-            round(current_week_score, 2),
-            round(current_week_score - previous_week_score, 2),
-        )
-        col3.metric(
-            "Avg Score",
-            round(current_month_score, 2),
-            round(current_month_score - previous_month_score, 2),
-        )
-        col4.metric(
-            "Avg Score",
-            round(current_quarter_score, 2),
-            round(current_quarter_score - previous_quarter_score, 2),
-        )
+        columns = st.columns([2, 2, 1, 1])
+        for col, (label, period) in zip(columns, view["period_metrics"]):
+            col.metric(label, period)
+        for col, (average, change) in zip(columns, view["average_metrics"]):
+            col.metric("Avg Score", average, change)
 
-    df_current_scores_display = df_current_scores[
-        ["metric_name", "day_score", "week_score", "month_score", "quarter_score"]
-    ]
-    df_current_scores_display["metric_name"] = df_current_scores_display[
-        "metric_name"
-    ].map(prettify_names)
-    df_current_scores_display = df_current_scores_display.set_index("metric_name")
-
-    def style_under_1(score, props=""):
-        return props if score < 1 else None
-
-    df_current_scores_display = (
-        df_current_scores_display.style.applymap(style_under_1, props="color:red;")
-        .applymap(lambda metric: "opacity: 20%;" if pd.isna(metric) else None)
-        .format("{:.3f}")
-        .set_table_styles(
-            [
-                {
-                    "selector": "th",
-                    "props": [("background-color", "#288BE4"), ["color", "white"]],
-                }
-            ]
-        )
-    )
-    st.table(df_current_scores_display)
+    with run_metrics.span("render.scores_table"):
+        st.markdown(view["table_html"], unsafe_allow_html=True)
 elif menu == "About the Metrics":
     st.markdown(
         """[Source: boston.gov](https://www.boston.gov/sites/default/files/file/document_files/2019/04/cityscore_metric_definitions_targets_for_website.pdf)"""
@@ -246,86 +191,178 @@ elif menu == "About the Metrics":
         see_stats = st.checkbox("See metric summary statistics")
     if see_stats:
         st.subheader("Metric Summary Statistics")
-        metric_summary_stats = df.groupby(["metric_name"]).agg(
-            {
-                "day": ["min", "max"],
-                "day_score": ["count", "min", "max"],
-                "week_score": ["count", "min", "max"],
-                "month_score": ["count", "min", "max"],
-                "quarter_score": ["count", "min", "max"],
-            }
-        )
-        metric_summary_stats.index = metric_summary_stats.index.map(prettify_names)
-        metric_summary_stats.columns = [
-            ": ".join(col) for col in metric_summary_stats.columns.values
-        ]
-        metric_summary_stats["day: min"] = metric_summary_stats["day: min"].dt.strftime(
-            "%Y-%m-%d"
-        )
-        metric_summary_stats["day: max"] = metric_summary_stats["day: max"].dt.strftime(
-            "%Y-%m-%d"
+        metric_summary_stats = derived(
+            "summary_stats",
+            lambda: pretty_names(aggs["summary_stats"], definitions["definitions"]),
         )
         st.dataframe(metric_summary_stats)
     st.subheader("Metric Definitions")
-    metric_info = (
-        df[["metric_name", "metric_logic", "target"]]
-        .drop_duplicates(subset=["metric_name"])
-        .reset_index(drop=True)
-    )
-    metric_info["metric_name_pretty"] = metric_info["metric_name"].map(prettify_names)
-    metric_info = metric_info.set_index("metric_name")
     if see_definitions == "All metric descriptions":
-        for metric in metric_definitions:
+        for m, metric in metric_table.iterrows():
             st.markdown(f"#### {metric['metric_pretty']}")
             st.markdown(metric["metric_description"])
-            m = metric["metric_name"]
             with st.container():
                 col1, col2 = st.columns([1, 8])
-            metric_logic = metric_info.loc[m, "metric_logic"]
-            metric_target = metric_info.loc[m, "target"]
-            col1.metric("Target", metric_target)
+            col1.metric("Target", metric["target"])
             col2.markdown("###### Metric Logic")
-            col2.markdown(metric_logic)
+            col2.markdown(metric["metric_logic"])
     elif see_definitions == "Some metric descriptions":
-        choose_metric_definition = st.multiselect("Choose metrics:", metric_pretty_list)
-        for metric in metric_definitions:
-            if metric["metric_pretty"] in choose_metric_definition:
-                st.markdown(f"#### {metric['metric_pretty']}")
-                st.markdown(metric["metric_description"])
-                m = metric["metric_name"]
-                with st.container():
-                    col1, col2 = st.columns([1, 8])
-                metric_logic = metric_info.loc[m, "metric_logic"]
-                metric_target = metric_info.loc[m, "target"]
-                col1.metric("Target", metric_target)
-                col2.markdown("###### Metric Logic")
-                col2.markdown(metric_logic)
+        choose_metric_definition = st.multiselect(
+            "Choose metrics:", list(metric_names.index)
+        )
+        chosen = metric_table[
+            metric_table["metric_pretty"].isin(choose_metric_definition)
+        ]
+        for m, metric in chosen.iterrows():
+            st.markdown(f"#### {metric['metric_pretty']}")
+            st.markdown(metric["metric_description"])
+            with st.container():
+                col1, col2 = st.columns([1, 8])
+            col1.metric("Target", metric["target"])
+            col2.markdown("###### Metric Logic")
+            col2.markdown(metric["metric_logic"])
 elif menu == "Historical Scores":
+    import plotly.express as px
+
     with st.sidebar:
         st.subheader("Options")
         time_unit = st.radio("Choose a time unit", ["day", "week", "month", "quarter"])
-        metric_selected = st.selectbox("Choose a metric", metric_pretty_list)
+        metric_selected = st.selectbox("Choose a metric", list(metric_names.index))
+        compare_with = st.multiselect(
+            "Compare with",
+            [metric for metric in metric_names.index if metric != metric_selected],
+        )
+        show_target = st.checkbox("Show the target")
+        history = rollups.series(
+            dataset["rollups"], time_unit, metric_names[metric_selected]
+        )
+        date_range = ()
+        if not history.empty:
+            first_period = history[f"{time_unit}"].iloc[0].date()
+            last_period = history[f"{time_unit}"].iloc[-1].date()
+            date_range = st.date_input(
+                "Date range",
+                value=(first_period, last_period),
+                min_value=first_period,
+                max_value=last_period,
+            )
         show_data = st.checkbox("Show the data")
-    trimmed_df = df[["metric_name", f"{time_unit}", f"{time_unit}_score"]]
-    trimmed_df["metric_name"] = trimmed_df["metric_name"].map(prettify_names)
-    trimmed_df = trimmed_df[trimmed_df["metric_name"] == metric_selected]
-    trimmed_df = trimmed_df.drop_duplicates().sort_values(by=[f"{time_unit}"])
-    fig = px.line(
-        trimmed_df,
-        x=f"{time_unit}",
-        y=f"{time_unit}_score",
-        title=f"{time_unit.capitalize()} Score for {metric_selected}",
-    )
-    st.plotly_chart(fig, use_container_width=True)
+    # the date range has a single date while the user is still picking it
+    if len(date_range) == 2:
+        trimmed_df = downsample.window(history, f"{time_unit}", *date_range)
+    else:
+        trimmed_df = history
+    with run_metrics.span("render.chart_figure"):
+        if compare_with:
+            chart_metrics = [metric_selected] + compare_with
+            chart_df = rollups.compare(
+                dataset["rollups"],
+                time_unit,
+                list(metric_names[chart_metrics]),
+                *(date_range if len(date_range) == 2 else ()),
+                max_points=downsample.MAX_CHART_POINTS,
+                labels=chart_metrics,
+            )
+            fig = px.line(
+                chart_df,
+                x=f"{time_unit}",
+                y=f"{time_unit}_score",
+                color="metric_name",
+                title=f"{time_unit.capitalize()} Scores",
+            )
+        else:
+            fig = px.line(
+                downsample.downsample(trimmed_df, f"{time_unit}", f"{time_unit}_score"),
+                x=f"{time_unit}",
+                y=f"{time_unit}_score",
+                title=f"{time_unit.capitalize()} Score for {metric_selected}",
+            )
+        if show_target:
+            # scores are relative to the target, so meeting it scores 1
+            target = rollups.target(dataset["rollups"], metric_names[metric_selected])
+            fig.add_hline(
+                y=1,
+                line_dash="dot",
+                annotation_text=f"Target ({target:g})",
+            )
+    # the figure is serialized to JSON here
+    with run_metrics.span("render.chart"):
+        st.plotly_chart(fig, use_container_width=True)
     if show_data:
-        st.dataframe(trimmed_df)
+        pages = downsample.page_count(trimmed_df)
+        page_number = st.number_input("Page", min_value=1, max_value=pages, value=1)
+        st.caption(f"{len(trimmed_df)} rows, page {page_number} of {pages}")
+        st.dataframe(
+            downsample.page(trimmed_df, page_number).assign(
+                metric_name=metric_selected
+            )[["metric_name", f"{time_unit}", f"{time_unit}_score"]]
+        )
 elif menu == "Show Me the Data":
-    st.dataframe(df.sort_values(by=["score_calculated_ts"], ascending=False))
-    today = df["day"].max().strftime("%Y-%m-%d")
-    csv = df_to_csv(df)
-    st.download_button(
-        label="Download data as CSV",
-        data=csv,
-        file_name=f"boston_cityscore_{today}.csv",
-        mime="text/csv",
+    from cityscore import export
+
+    first_day = aggs["summary"][("day", "min")].min().date()
+    last_day = aggs["summary"][("day", "max")].max().date()
+    with st.sidebar:
+        st.subheader("Options")
+        columns = st.multiselect("Columns", list(df.columns), default=list(df.columns))
+        date_range = st.date_input(
+            "Date range",
+            value=(first_day, last_day),
+            min_value=first_day,
+            max_value=last_day,
+        )
+        export_format = st.radio("Download format", list(export.FORMATS))
+    # the date range has a single date while the user is still picking it
+    if len(date_range) == 2:
+        start, end = (pd.Timestamp(d) for d in date_range)
+    else:
+        start, end = None, None
+    # the view pages through row positions, so only the page shown is copied
+    rows = export.filter_rows(df, start, end)
+    if rows is None:
+        rows = range(len(df))
+    # records are added as scores are calculated, so newest first is reverse _id
+    rows = rows[::-1]
+
+    pages = downsample.page_count(rows)
+    page_number = st.number_input("Page", min_value=1, max_value=pages, value=1)
+    st.caption(f"{len(rows)} rows, page {page_number} of {pages}")
+    st.dataframe(
+        export.filter_frame(
+            df.iloc[downsample.page(rows, page_number)], columns or None
+        )
+    )
+
+    # the export is only written out when asked for, instead of keeping a
+    # serialized copy of the data around for every visit to this page
+    file_format = export.FORMATS[export_format]
+    if st.button(f"Prepare {export_format} download"):
+        with run_metrics.span("render.export"):
+            filtered_df = export.filter_frame(df, columns or None, start, end)
+            data = b"".join(export.iter_export(filtered_df, export_format))
+        st.download_button(
+            label=f"Download data as {export_format}",
+            data=data,
+            file_name=f"boston_cityscore_{last_day:%Y-%m-%d}.{file_format['extension']}",
+            mime=file_format["mime"],
+        )
+run_metrics.record(page_span, time.perf_counter() - page_start)
+
+# one line per script run, with what this run spent its time on
+logger.info(
+    instrument.log_line(
+        run_metrics.snapshot(),
+        page=page_span,
+        version=dataset["etag"] if dataset else None,
     )
+)
+if DEBUG:
+    with st.expander("Performance"):
+        st.markdown("###### This run")
+        run_spans = run_metrics.snapshot()["spans"]
+        st.dataframe(pd.DataFrame.from_dict(run_spans, orient="index"))
+        process = instrument.metrics.snapshot()
+        st.markdown("###### Since the app started")
+        st.dataframe(pd.DataFrame.from_dict(process["spans"], orient="index"))
+        cache = cache_metrics()
+        st.json({**process["counters"], **cache["counters"], **cache["gauges"]})
@@ -0,0 +1,196 @@
+# Local stand-in for the Analyze Boston CKAN datastore API
+# Serves recorded or synthetic raw data through datastore_search and
+# datastore_search_sql, so the fetch code can run without the network
+
+import gzip
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import numpy as np
+import pandas as pd
+from cityscore.ckan import BOSTON_API_ROOT, fetch_data
+from cityscore.enhance import TIME_UNITS
+from cityscore.metric_definitions import metric_definitions
+
+FIELDS = (
+    ["_id", "metric_name", "metric_logic", "score_calculated_ts", "target"]
+    + [
+        f"{unit}_{column}"
+        for unit in TIME_UNITS
+        for column in ["score", "numerator", "denominator"]
+    ]
+    + ["latest_score_flag"]
+)
+# roughly the history held by Analyze Boston when the app was last updated
+HISTORY_START = "2016-01-01"
+HISTORY_END = "2021-11-29"
+
+
+def synthetic_frame(scale=1, start=HISTORY_START, end=HISTORY_END, seed=0):
+    """
+    Generate raw records of daily scores for every metric, as text like the
+    datastore returns them. The history is made scale times bigger by adding
+    copies of the metrics rather than more days, so the dates stay realistic
+    """
+    rng = np.random.default_rng(seed)
+    metric_names = np.array(
+        [
+            m["metric_name"] if copy == 0 else f"{m['metric_name']} #{copy + 1}"
+            for copy in range(scale)
+            for m in metric_definitions
+        ],
+        dtype=object,
+    )
+    days = pd.date_range(start, end, freq="D")
+    rows = len(days) * len(metric_names)
+    calculated = (days + pd.Timedelta(hours=6)).strftime("%Y-%m-%dT%H:%M:%S")
+
+    df = pd.DataFrame(
+        {
+            "_id": np.arange(1, rows + 1),
+            "metric_name": np.tile(metric_names, len(days)),
+            "score_calculated_ts": np.repeat(np.asarray(calculated), len(metric_names)),
+            "target": "0.9",
+        }
+    )
+    df["metric_logic"] = "Logic of " + df["metric_name"]
+    for unit in TIME_UNITS:
+        denominator = rng.integers(1, 500, rows)
+        scores = np.round(rng.uniform(0.4, 1.6, rows), 3).astype(str).astype(object)
+        scores[rng.random(rows) < 0.05] = None
+        df[f"{unit}_score"] = scores
+        df[f"{unit}_numerator"] = (
+            (denominator * rng.random(rows)).astype(int).astype(str)
+        )
+        df[f"{unit}_denominator"] = denominator.astype(str)
+    df["latest_score_flag"] = "0"
+    df.iloc[-len(metric_names) :, df.columns.get_loc("latest_score_flag")] = "1"
+    return df[FIELDS]
+
+
+def record_fixture(resource_id, path, api_root=BOSTON_API_ROOT):
+    """
+    Record every record of a live resource to a gzipped JSON fixture
+    """
+    df = fetch_data(resource_id, api_root)
+    with gzip.open(path, "wt", encoding="utf-8") as f:
+        df.to_json(f, orient="table", index=False)
+
+
+def load_fixture(path, scale=1):
+    """
+    Load the records of a recorded fixture, scaled up like synthetic_frame by
+    adding copies of every metric
+    """
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        recorded = pd.read_json(f, orient="table", dtype=False, convert_dates=False)
+    copies = []
+    for copy in range(scale):
+        df = recorded.copy()
+        if copy:
+            df["metric_name"] = df["metric_name"] + f" #{copy + 1}"
+        copies.append(df)
+    df = pd.concat(copies, ignore_index=True)
+    df["_id"] = np.arange(1, len(df) + 1)
+    return df
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server.fixture
+        server.requests += 1
+        if server.latency:
+            time.sleep(server.latency)
+        if server.error_rate and random.random() < server.error_rate:
+            self.send_error(503)
+            return
+
+        url = urlparse(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        fields = [{"id": field, "type": "text"} for field in server.fields]
+        if url.path.endswith("/datastore_search"):
+            limit = min(int(query.get("limit", 100)), server.rows_max)
+            offset = int(query.get("offset", 0))
+            result = {
+                "total": len(server.df),
+                "fields": fields,
+                "records": server.page(offset, limit),
+                "_links": {
+                    "next": f"{url.path}?resource_id={query['resource_id']}"
+                    f"&limit={limit}&offset={offset + limit}"
+                },
+            }
+        elif url.path.endswith("/datastore_search_sql"):
+            sql = query["sql"]
+            last_id = re.search(r"_id > (\d+)", sql)
+            last_id = int(last_id.group(1)) if last_id else 0
+            limit = min(int(re.search(r"LIMIT (\d+)", sql).group(1)), server.rows_max)
+            offset = int(re.search(r"OFFSET (\d+)", sql).group(1))
+            # records are sorted by _id, and _ids start at 1 without gaps
+            selected = server.page(last_id + offset, limit)
+            result = {"fields": fields, "records": selected}
+        else:
+            self.send_error(404)
+            return
+
+        body = json.dumps({"success": True, "result": result}).encode("utf-8")
+        if "gzip" in self.headers.get("Accept-Encoding", ""):
+            body = gzip.compress(body, compresslevel=1)
+            self.send_response(200)
+            self.send_header("Content-Encoding", "gzip")
+        else:
+            self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        server.bytes_sent += len(body)
+
+
+class FixtureServer:
+    """
+    CKAN datastore API serving the rows of a raw dataframe on a local port,
+    with optional latency and error injection. Like CKAN's
+    ckan.datastore.search.rows_max, rows_max caps the records of a page.
+    Use as a context manager
+    """
+
+    def __init__(self, df, latency=0.0, error_rate=0.0, rows_max=32000):
+        self.df = df
+        self.fields = list(df.columns)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rows_max = rows_max
+        self.requests = 0
+        self.bytes_sent = 0
+        self._httpd = None
+
+    def page(self, offset, limit):
+        """
+        Get records as the datastore returns them, converting only the rows asked for
+        """
+        rows = self.df.iloc[offset : offset + limit]
+        return json.loads(rows.to_json(orient="records"))
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def __enter__(self):
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        self._httpd.daemon_threads = True
+        self._httpd.fixture = self
+        threading.Thread(target=self._httpd.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._httpd.shutdown()
+        self._httpd.server_close()
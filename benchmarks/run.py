@@ -0,0 +1,225 @@
+# Benchmarks for the fetch -> enhance -> render pipeline
+#
+# usage: python -m benchmarks.run [--scales 1 10 100] [--fixture path]
+#                                 [--save | --compare] [--threshold 0.25]
+#        python -m benchmarks.run --record path
+#
+# Raw data comes from a recorded fixture or is generated, and is served by a
+# local CKAN stand-in. Every stage reports its wall time, the peak
+# RSS of the process while it ran and the peak memory it allocated
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from cityscore import aggregates
+from cityscore import ckan
+from cityscore import export
+from cityscore import rollups
+from cityscore import score_index
+from cityscore.current_scores import build_view
+from cityscore.definitions import definitions_frame
+from cityscore.enhance import enhance_dataframe
+from benchmarks.ckan_fixture import (
+    FixtureServer,
+    load_fixture,
+    record_fixture,
+    synthetic_frame,
+)
+
+BASELINES_PATH = os.path.join(os.path.dirname(__file__), "baselines.json")
+RESOURCE_ID = "dd657c02-3443-4c00-8b29-56a40cfe7ee4"
+MB = 1024 * 1024
+# beyond this, fetching through the local server takes too long and too much
+# memory to be worth it, so the stage is skipped
+MAX_FETCH_ROWS = 1_000_000
+# timings are the best of this many runs, to keep noise out of comparisons
+REPEAT = 3
+
+
+def rss():
+    """
+    Get the resident set size of this process in bytes
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        import resource
+
+        # not the current RSS, but the best portable approximation
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class _RssSampler(threading.Thread):
+    """
+    Samples the RSS in the background, keeping the highest value
+    """
+
+    def __init__(self, interval=0.005):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.peak = rss()
+        self._done = threading.Event()
+
+    def run(self):
+        while not self._done.wait(self.interval):
+            self.peak = max(self.peak, rss())
+
+    def stop(self):
+        self._done.set()
+        self.join()
+        self.peak = max(self.peak, rss())
+        return self.peak
+
+
+def measure(stage, *args, repeat=REPEAT):
+    """
+    Run a stage repeat times for its best wall time and peak RSS, and once
+    more under tracemalloc for the peak memory it allocates. Returns the
+    stage's result and its measurements
+    """
+    sampler = _RssSampler()
+    sampler.start()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = stage(*args)
+        timings.append(time.perf_counter() - start)
+    peak_rss = sampler.stop()
+
+    tracemalloc.start()
+    stage(*args)
+    _, peak_allocated = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, {
+        "seconds": round(min(timings), 4),
+        "peak_rss_mb": round(peak_rss / MB, 1),
+        "peak_allocated_mb": round(peak_allocated / MB, 1),
+    }
+
+
+def current_scores(df, definitions):
+    index = score_index.build_score_index(df)
+    return build_view(index, aggregates.period_averages(index), definitions)
+
+
+def summary_stats(df):
+    return aggregates.format_summary(aggregates.summarize(df))
+
+
+def export_csv(df):
+    return sum(len(chunk) for chunk in export.iter_export(df, "CSV"))
+
+
+def run_scale(raw, max_fetch_rows=MAX_FETCH_ROWS):
+    """
+    Run every stage of the pipeline on a raw dataframe
+    """
+    results = {"rows": len(raw)}
+    if len(raw) <= max_fetch_rows:
+        with FixtureServer(raw) as server:
+            raw, results["fetch"] = measure(ckan.fetch_data, RESOURCE_ID, server.url)
+    else:
+        results["fetch"] = "skipped"
+    df, results["enhance"] = measure(enhance_dataframe, raw)
+    _, results["current_scores"] = measure(current_scores, df, definitions_frame())
+    _, results["rollups"] = measure(rollups.build_rollups, df)
+    _, results["summary_stats"] = measure(summary_stats, df)
+    _, results["export_csv"] = measure(export_csv, df)
+    return results
+
+
+def compare(results, baselines, threshold):
+    """
+    List the stages whose wall time or allocations grew by more than threshold
+    (a fraction) over their baseline, and the stages that have no baseline
+    """
+    regressions, missing = [], []
+    for scale, stages in results.items():
+        for stage, measured in stages.items():
+            if not isinstance(measured, dict):
+                continue
+            baseline = baselines.get(scale, {}).get(stage)
+            if not isinstance(baseline, dict):
+                missing.append(f"{scale} {stage}")
+                continue
+            for metric in ["seconds", "peak_allocated_mb"]:
+                if baseline[metric] and measured[metric] > baseline[metric] * (
+                    1 + threshold
+                ):
+                    regressions.append(
+                        f"{scale} {stage} {metric}: "
+                        f"{measured[metric]} vs baseline {baseline[metric]}"
+                    )
+    return regressions, missing
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark the fetch, enhance and render stages of the app"
+    )
+    parser.add_argument("--scales", type=int, nargs="+", default=[1, 10, 100])
+    parser.add_argument("--fixture", help="gzipped JSON fixture of recorded records")
+    parser.add_argument(
+        "--record",
+        metavar="PATH",
+        help="record the live resource to a fixture at PATH and exit",
+    )
+    parser.add_argument("--baselines", default=BASELINES_PATH)
+    parser.add_argument("--save", action="store_true", help="save as the baselines")
+    parser.add_argument(
+        "--compare", action="store_true", help="fail on regressions over baselines"
+    )
+    parser.add_argument("--threshold", type=float, default=0.25)
+    parser.add_argument("--max-fetch-rows", type=int, default=MAX_FETCH_ROWS)
+    args = parser.parse_args(argv)
+
+    if args.record:
+        record_fixture(RESOURCE_ID, args.record)
+        return 0
+
+    baselines = {}
+    if os.path.exists(args.baselines):
+        with open(args.baselines) as f:
+            baselines = json.load(f)
+    if args.compare:
+        # fail before spending minutes on a scale there is nothing to compare to
+        missing = [scale for scale in args.scales if f"{scale}x" not in baselines]
+        if missing:
+            print(
+                f"MISSING BASELINE for scales {missing}: run with --save first, "
+                "or pick --scales that have one",
+                file=sys.stderr,
+            )
+            return 1
+
+    results = {}
+    for scale in args.scales:
+        if args.fixture:
+            raw = load_fixture(args.fixture, scale)
+        else:
+            raw = synthetic_frame(scale)
+        results[f"{scale}x"] = run_scale(raw, args.max_fetch_rows)
+        del raw
+        print(json.dumps({f"{scale}x": results[f"{scale}x"]}, indent=2))
+
+    if args.save:
+        # scales that were not run keep their baselines
+        with open(args.baselines, "w") as f:
+            json.dump({**baselines, **results}, f, indent=2)
+    if args.compare:
+        regressions, missing = compare(results, baselines, args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        for stage in missing:
+            print(f"MISSING BASELINE for {stage}", file=sys.stderr)
+        return 1 if regressions or missing else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
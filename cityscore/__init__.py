@@ -0,0 +1,3 @@
+# Data engine behind the CityScore app: fetching, enhancing, aggregating and
+# exporting the CityScore data, usable without Streamlit
+# Modules are imported on use, so importing the package stays cheap
@@ -0,0 +1,83 @@
+# Headless batch job publishing snapshots of CityScore resources
+#
+# usage: python -m cityscore [--resource-id ID ...] [--max-age SECONDS]
+#
+# Syncs every resource with Analyze Boston, then writes its raw data and what
+# is derived from it (e.g. the enhanced data and aggregates of the full metric
+# list) to the disk cache (CITYSCORE_CACHE_DIR) as a new version. App processes
+# started with CITYSCORE_SNAPSHOTS_ONLY only read these snapshots, so one job
+# run from cron can keep every replica warm
+
+import argparse
+import logging
+import sys
+from . import instrument
+from .ckan import BOSTON_API_ROOT
+from .dataset import load_snapshot
+from .resources import DEFAULT_RESOURCES, build_resources
+
+logger = logging.getLogger("cityscore")
+
+
+def publish(resource_ids=DEFAULT_RESOURCES, max_age=0, api_root=BOSTON_API_ROOT):
+    """
+    Build and publish snapshots of resources whose data is at most max_age
+    seconds old, concurrently. Returns the datasets and the errors of the
+    resources that failed, as dicts by resource id
+    """
+    with instrument.span("snapshot"):
+        # each version is built from the last one published, so only the rows
+        # added since are synced and aggregated
+        previous = {
+            resource_id: load_snapshot(resource_id) for resource_id in resource_ids
+        }
+        datasets, errors = build_resources(
+            resource_ids,
+            previous,
+            max_age=max_age,
+            api_root=api_root,
+            use_bundled=False,
+            headless=True,
+        )
+    for resource_id, dataset in datasets.items():
+        logger.info(
+            "published %s version %s (%d rows)",
+            resource_id,
+            dataset["etag"],
+            len(dataset["raw"]),
+        )
+    for resource_id, error in errors.items():
+        logger.error("publishing %s failed: %s", resource_id, error)
+    return datasets, errors
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Publish snapshots of CityScore resources to the disk cache"
+    )
+    parser.add_argument(
+        "--resource-id",
+        dest="resource_ids",
+        action="append",
+        help="resource to publish, may be repeated (default: the full metric "
+        "list and the metric definitions)",
+    )
+    parser.add_argument(
+        "--max-age",
+        type=float,
+        default=0,
+        help="reuse a snapshot at most this many seconds old instead of syncing",
+    )
+    parser.add_argument("--api-root", default=BOSTON_API_ROOT)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    _, errors = publish(
+        args.resource_ids or DEFAULT_RESOURCES, args.max_age, args.api_root
+    )
+    logger.info(instrument.log_line(instrument.metrics.snapshot()))
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,134 @@
+# Aggregates materialized once per version of the data, so pages only read them
+
+import pandas as pd
+from .enhance import TIME_UNITS
+from . import score_index
+from . import instrument
+
+# bump whenever the aggregates change, to invalidate cached copies
+AGGREGATES_VERSION = 3
+# aggregates that are frames, as opposed to the values kept alongside them
+AGGREGATE_FRAMES = ["summary", "summary_stats", "metric_info"]
+
+SUMMARY_AGGREGATIONS = {
+    "day": ["min", "max"],
+    **{f"{unit}_score": ["count", "min", "max"] for unit in TIME_UNITS},
+}
+
+
+def summarize(df):
+    """
+    Compute the per-metric summary statistics of an enhanced dataframe
+    """
+    summary = df.groupby(["metric_name"], observed=True).agg(SUMMARY_AGGREGATIONS)
+    summary.index = summary.index.astype(str)
+    return summary.sort_index()
+
+
+def combine_summaries(summary, other):
+    """
+    Combine the summary statistics of two sets of rows, as if they had been
+    computed over both sets at once
+    """
+    combined = pd.concat([summary, other]).groupby(level=0)
+    return pd.concat(
+        [
+            getattr(combined[[column]], "sum" if column[1] == "count" else column[1])()
+            for column in summary.columns
+        ],
+        axis=1,
+    )
+
+
+def format_summary(summary):
+    """
+    Format summary statistics for display, still indexed by metric_name
+    """
+    summary = summary.copy()
+    summary.columns = [": ".join(col) for col in summary.columns.values]
+    summary["day: min"] = summary["day: min"].dt.strftime("%Y-%m-%d")
+    summary["day: max"] = summary["day: max"].dt.strftime("%Y-%m-%d")
+    return summary
+
+
+def latest_values(df, columns):
+    """
+    Get the latest value given for columns of each metric, skipping missing
+    ones, indexed by metric_name
+    """
+    latest = df.groupby("metric_name", observed=True, sort=False)[columns].last()
+    latest.index = latest.index.astype(str)
+    return latest
+
+
+def metric_info(df):
+    """
+    Get the latest logic and target of each metric, indexed by metric_name
+    """
+    return latest_values(df, ["metric_logic", "target"])
+
+
+def period_averages(index):
+    """
+    Get the average score across metrics for the current and previous period
+    of every time unit
+    """
+    averages = {}
+    for unit in TIME_UNITS:
+        period = score_index.current_period(index, unit)
+        averages[unit] = {
+            "period": period,
+            "current": score_index.period_average(index, unit, period),
+            "previous": score_index.period_average(
+                index, unit, score_index.previous_period(unit, period)
+            ),
+        }
+    return averages
+
+
+@instrument.timed("aggregates.materialize")
+def materialize(df, index):
+    """
+    Compute every aggregate for an enhanced dataframe and its score index
+    """
+    summary = summarize(df)
+    return {
+        "rows": len(df),
+        "last_id": df.index[-1] if len(df) else None,
+        "summary": summary,
+        "summary_stats": format_summary(summary),
+        "metric_info": metric_info(df),
+        "period_averages": period_averages(index),
+    }
+
+
+@instrument.timed("aggregates.update")
+def update_aggregates(aggregates, df, index):
+    """
+    Bring aggregates up to date with a newer version of the dataframe. When the
+    new version only appends rows, only those rows are aggregated; otherwise
+    everything is recomputed
+    """
+    rows = aggregates["rows"]
+    if rows == 0 or len(df) < rows or df.index[rows - 1] != aggregates["last_id"]:
+        return materialize(df, index)
+
+    delta = df.iloc[rows:]
+    if delta.empty:
+        return dict(aggregates, period_averages=period_averages(index))
+    summary = combine_summaries(aggregates["summary"], summarize(delta))
+    # the delta holds the latest logic and target of the metrics it covers
+    new_info = metric_info(delta)
+    info = aggregates["metric_info"]
+    info = info.reindex(
+        info.index.append(new_info.index[~new_info.index.isin(info.index)])
+    )
+    info.update(new_info)
+    return {
+        "rows": len(df),
+        "last_id": df.index[-1],
+        "summary": summary,
+        "summary_stats": format_summary(summary),
+        "metric_info": info,
+        "period_averages": period_averages(index),
+    }
@@ -0,0 +1,11 @@
+# Backoff between retries, shared by the HTTP client and the dataset refresher
+
+import random
+
+
+def backoff_delay(attempt, base, cap):
+    """
+    Seconds to wait before retrying a failed attempt: exponential backoff with
+    full jitter, so processes that failed together do not retry together
+    """
+    return random.uniform(0, min(cap, base * 2**attempt))
@@ -0,0 +1,173 @@
+# CKAN Datastore API
+# docs: https://docs.ckan.org/en/latest/maintaining/datastore.html#the-datastore-api
+
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+from itertools import chain
+import pandas as pd
+from . import instrument
+from .client import MAX_WORKERS, CkanClient, CkanError
+
+BOSTON_API_ROOT = "https://data.boston.gov"
+SEARCH_ENDPOINT = "/api/3/action/datastore_search"
+SQL_ENDPOINT = "/api/3/action/datastore_search_sql"
+PAGE_SIZE = 32000
+
+
+def fetch_page(client, resource_id, offset, limit=PAGE_SIZE):
+    """
+    Fetch one page of records, ordered by _id so page offsets are stable
+    """
+    with instrument.span("ckan.page"):
+        result, r = client.get(
+            SEARCH_ENDPOINT,
+            {
+                "resource_id": resource_id,
+                "limit": limit,
+                "offset": offset,
+                "sort": "_id",
+            },
+        )
+    count_page(r, result["records"])
+    return result
+
+
+def count_page(r, records):
+    """
+    Count a fetched page, the bytes it took on the wire and its records
+    """
+    instrument.count("ckan.pages")
+    instrument.count("ckan.bytes", int(r.headers.get("Content-Length", len(r.content))))
+    instrument.count("ckan.records", len(records))
+
+
+@instrument.timed("ckan.fetch")
+def fetch_data(
+    resource_id,
+    api_root=BOSTON_API_ROOT,
+    max_workers=MAX_WORKERS,
+    page_size=PAGE_SIZE,
+    client=None,
+):
+    """
+    Fetch all data from Analyze Boston for a given resource id.
+    The first page gives the total number of records, so the offsets of the
+    remaining pages are planned up front and fetched concurrently
+    """
+    own_client = client is None
+    if own_client:
+        client = CkanClient(api_root, max_workers)
+    try:
+        # initial request
+        first_page = fetch_page(client, resource_id, 0, page_size)
+        fields = [c["id"] for c in first_page["fields"]]
+
+        # fetch the remaining pages, keeping them in offset order. The server
+        # may cap pages below page_size, so step by what the first page held
+        step = len(first_page["records"]) or page_size
+        offsets = range(len(first_page["records"]), first_page["total"], step)
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            pages = pool.map(
+                lambda offset: fetch_page(client, resource_id, offset, page_size),
+                offsets,
+            )
+            all_records = list(
+                chain(first_page["records"], *(page["records"] for page in pages))
+            )
+    finally:
+        if own_client:
+            client.close()
+    # never hand back a partial frame, which would be cached as a version
+    if len(all_records) != first_page["total"]:
+        raise CkanError(
+            f"fetched {len(all_records)} of {first_page['total']} records "
+            f"of {resource_id}"
+        )
+
+    # convert to dataframe and fix column order
+    df = pd.DataFrame(all_records)
+    df = df.reindex(columns=fields)
+    return df
+
+
+def fetch_total(client, resource_id):
+    """
+    Fetch the number of records Analyze Boston holds for a given resource id
+    """
+    result, _ = client.get(SEARCH_ENDPOINT, {"resource_id": resource_id, "limit": 0})
+    return result["total"]
+
+
+def fetch_new_records(client, resource_id, last_id):
+    """
+    Fetch the records added to a resource after the record with id last_id.
+    The server may cap pages below PAGE_SIZE, so paging stops at an empty page,
+    or at a page shorter than one before it, which only comes at the end
+    """
+    sql = f'SELECT * FROM "{resource_id}" WHERE _id > {int(last_id)} ORDER BY _id'
+
+    new_records = []
+    longest = 0
+    while True:
+        with instrument.span("ckan.page"):
+            result, r = client.get(
+                SQL_ENDPOINT,
+                {"sql": f"{sql} LIMIT {PAGE_SIZE} OFFSET {len(new_records)}"},
+            )
+        records = result["records"]
+        count_page(r, records)
+        new_records.extend(records)
+        if not records or len(records) < longest:
+            return new_records
+        longest = len(records)
+
+
+@instrument.timed("ckan.sync")
+def sync_data(resource_id, df=None, api_root=BOSTON_API_ROOT):
+    """
+    Bring previously fetched data up to date, only downloading the new records.
+    Falls back to a full fetch when there is nothing to sync against, or when the
+    upstream resource no longer lines up with what we hold (e.g. it was reloaded)
+    """
+    with CkanClient(api_root) as client:
+        if df is None or df.empty:
+            return fetch_data(resource_id, api_root, client=client)
+
+        new_records = fetch_new_records(client, resource_id, df["_id"].max())
+        if len(df) + len(new_records) != fetch_total(client, resource_id):
+            return fetch_data(resource_id, api_root, client=client)
+    if not new_records:
+        return df
+
+    df_new = pd.DataFrame(new_records).reindex(columns=df.columns)
+    # rows that were the latest score for a metric are superseded by the new ones
+    if "latest_score_flag" in df.columns:
+        df = df.copy()
+        df_new["latest_score_flag"] = df_new["latest_score_flag"].astype(int)
+        updated_metrics = df_new.loc[df_new["latest_score_flag"] == 1, "metric_name"]
+        df["latest_score_flag"] = (
+            df["latest_score_flag"]
+            .astype(int)
+            .mask(df["metric_name"].isin(updated_metrics), 0)
+        )
+    return pd.concat([df, df_new], ignore_index=True)
+
+
+def version_token(df):
+    """
+    Cheap token identifying a snapshot of a resource's records. Records are only
+    ever appended, so the row count and the highest _id pin down the snapshot
+    """
+    if df.empty:
+        return "0-0"
+    return f"{len(df)}-{df['_id'].max()}"
+
+
+def content_token(df):
+    """
+    Token identifying a snapshot of a resource whose records may be edited in
+    place, which leaves the row count and the highest _id as they were. Hashes
+    every record, so only meant for small resources
+    """
+    hashes = pd.util.hash_pandas_object(df, index=False).to_numpy()
+    return f"{len(df)}-{hashlib.sha1(hashes.tobytes()).hexdigest()[:16]}"
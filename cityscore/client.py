@@ -0,0 +1,192 @@
+# HTTP client for the CKAN datastore API
+# Pools connections, times out slow requests, retries failed ones with backoff,
+# and stops calling an API that keeps failing
+
+import logging
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from . import instrument
+from .backoff import backoff_delay
+
+logger = logging.getLogger(__name__)
+
+MAX_WORKERS = 4
+# seconds to connect, and to wait for each chunk of a response
+TIMEOUT = (5, 60)
+MAX_ATTEMPTS = 4
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 10
+# consecutive failed requests that open the circuit, and seconds it stays open
+FAILURE_THRESHOLD = 5
+RESET_TIMEOUT = 60
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+RETRY_ERRORS = (
+    requests.ConnectionError,
+    requests.Timeout,
+    requests.exceptions.ChunkedEncodingError,
+    requests.exceptions.ContentDecodingError,
+)
+
+# circuit breakers shared by every client in the process, by API root
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+class CkanError(Exception):
+    """
+    A request to the CKAN API failed
+    """
+
+
+class CircuitOpenError(CkanError):
+    """
+    A request was not sent because the API has been failing
+    """
+
+
+class CircuitBreaker:
+    """
+    Counts consecutive failures, and once there are failure_threshold of them
+    rejects calls for reset_timeout seconds. After that a single trial call is
+    let through, which closes the circuit again if it succeeds
+    """
+
+    def __init__(
+        self, failure_threshold=FAILURE_THRESHOLD, reset_timeout=RESET_TIMEOUT
+    ):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """
+        Get whether a call may go ahead
+        """
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if self._trial or time.monotonic() - self._opened_at < self.reset_timeout:
+                return False
+            self._trial = True
+            return True
+
+    def success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial = False
+
+    def failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial or self._failures >= self.failure_threshold:
+                if self._opened_at is None or self._trial:
+                    logger.warning(
+                        "opening the circuit after %d failures", self._failures
+                    )
+                    instrument.count("ckan.circuit_opened")
+                self._opened_at = time.monotonic()
+                self._trial = False
+
+
+def shared_breaker(api_root):
+    """
+    Get the process-wide circuit breaker for an API root
+    """
+    with _breakers_lock:
+        if api_root not in _breakers:
+            _breakers[api_root] = CircuitBreaker()
+        return _breakers[api_root]
+
+
+class CkanClient:
+    """
+    Client for one CKAN API root, safe to share between threads. Use as a
+    context manager, or close it when done
+    """
+
+    def __init__(
+        self,
+        api_root,
+        max_workers=MAX_WORKERS,
+        timeout=TIMEOUT,
+        max_attempts=MAX_ATTEMPTS,
+        backoff_base=BACKOFF_BASE,
+        breaker=None,
+    ):
+        self.api_root = api_root
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.breaker = breaker if breaker is not None else shared_breaker(api_root)
+        # keep one connection alive per worker
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        # requests already asks for gzip or deflate encoded responses
+
+    def get(self, endpoint, params):
+        """
+        Call an API action and get its result along with the response, retrying
+        timeouts, connection errors and server errors with backoff
+        """
+        for attempt in range(self.max_attempts):
+            if not self.breaker.allow():
+                raise CircuitOpenError(f"{self.api_root} has been failing")
+            failed = True
+            try:
+                r = self.session.get(
+                    f"{self.api_root}{endpoint}", params=params, timeout=self.timeout
+                )
+                if r.status_code in RETRY_STATUSES:
+                    raise CkanError(f"{endpoint} returned {r.status_code}")
+                failed = False
+            except (*RETRY_ERRORS, CkanError) as e:
+                error = e
+            except requests.RequestException as e:
+                # not worth retrying (e.g. too many redirects)
+                raise CkanError(f"{endpoint} failed: {e}") from e
+            finally:
+                # record every outcome, whatever was raised, so a half-open
+                # circuit is never left waiting on its trial call
+                if failed:
+                    self.breaker.failure()
+                    instrument.count("ckan.errors")
+                else:
+                    self.breaker.success()
+            if failed:
+                if attempt + 1 == self.max_attempts:
+                    raise CkanError(
+                        f"{endpoint} failed after {self.max_attempts} attempts: {error}"
+                    ) from error
+                logger.info("retrying %s after: %s", endpoint, error)
+                instrument.count("ckan.retries")
+                time.sleep(backoff_delay(attempt, self.backoff_base, BACKOFF_MAX))
+                continue
+
+            # the API answered, so there is no point retrying other errors
+            try:
+                body = r.json()
+            except ValueError:
+                body = {}
+            if not r.ok or not body.get("success"):
+                raise CkanError(
+                    f"{endpoint} failed with status {r.status_code}: "
+                    f"{body.get('error', 'invalid response')}"
+                )
+            return body["result"], r
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,90 @@
+# Precomputed render of the Current Scores page
+# The styled table and the period metrics only change with the data, so they
+# are built once per version and page reruns just send them out
+
+import html
+import numpy as np
+import pandas as pd
+from . import score_index
+from .definitions import pretty_names
+from .enhance import TIME_UNITS
+
+SCORE_COLUMNS = [f"{unit}_score" for unit in TIME_UNITS]
+UNDER_TARGET_STYLE = "color:red;"
+MISSING_STYLE = "opacity: 20%;"
+TABLE_CSS = """
+<style>
+table.current-scores th {background-color: #288BE4; color: white;}
+</style>
+"""
+
+
+def cell_styles(values):
+    """
+    Get the inline style of every cell of a 2d array of scores: red when under
+    1, faded when missing
+    """
+    missing = np.isnan(values)
+    with np.errstate(invalid="ignore"):
+        under = values < 1
+    return np.char.add(
+        np.where(under, UNDER_TARGET_STYLE, ""), np.where(missing, MISSING_STYLE, "")
+    )
+
+
+def table_html(frame, decimals=3):
+    """
+    Render a frame of scores as an HTML table, with the cells formatted and
+    styled in a few array operations instead of once per cell
+    """
+    values = frame.to_numpy(dtype="float64")
+    text = np.char.mod(f"%.{decimals}f", values)
+    styles = cell_styles(values)
+    cells = np.char.add(
+        np.char.add(np.char.add('<td style="', styles), '">'),
+        np.char.add(text, "</td>"),
+    )
+    index = [html.escape(str(label)) for label in frame.index]
+    rows = "".join(
+        f"<tr><th>{label}</th>{''.join(row)}</tr>" for label, row in zip(index, cells)
+    )
+    header = "".join(f"<th>{html.escape(str(c))}</th>" for c in frame.columns)
+    return (
+        f'{TABLE_CSS}<table class="current-scores"><thead><tr>'
+        f"<th>{html.escape(str(frame.index.name or ''))}</th>{header}</tr></thead>"
+        f"<tbody>{rows}</tbody></table>"
+    )
+
+
+def build_view(index, averages, definitions):
+    """
+    Build everything the Current Scores page shows for a version of the data
+    and of the metric definitions: the period of each time unit, its average
+    score and change, and the styled table of the latest scores
+    """
+    periods = {unit: averages[unit]["period"] for unit in TIME_UNITS}
+    period_metrics = [
+        ("Day", periods["day"].strftime("%b %d, %Y")),
+        ("Week of", periods["week"].strftime("%b %d, %Y")),
+        ("Month", periods["month"].month),
+        ("Quarter", periods["quarter"].quarter),
+    ]
+    average_metrics = [
+        (
+            round(averages[unit]["current"], 2),
+            round(averages[unit]["current"] - averages[unit]["previous"], 2),
+        )
+        for unit in TIME_UNITS
+    ]
+
+    latest = score_index.latest_scores(index)
+    display = pd.DataFrame(
+        latest[SCORE_COLUMNS].to_numpy(),
+        index=pd.Index(latest["metric_name"].astype(str), name="metric_name"),
+        columns=SCORE_COLUMNS,
+    )
+    return {
+        "period_metrics": period_metrics,
+        "average_metrics": average_metrics,
+        "table_html": table_html(pretty_names(display, definitions)),
+    }
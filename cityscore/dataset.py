@@ -0,0 +1,229 @@
+# A version of a CityScore resource along with everything derived from it
+# A dataset is a dict holding the raw and enhanced data, the score index, the
+# rollups and the aggregates, built from the previous version where possible
+
+import math
+import time
+import pandas as pd
+from .ckan import BOSTON_API_ROOT, content_token, sync_data, version_token
+from . import disk_cache
+from .enhance import ENHANCE_VERSION, enhance_dataframe
+from .memory_cache import MemoryCache
+from . import score_index
+from . import aggregates
+from . import rollups
+from . import instrument
+
+
+def load_raw(
+    resource_id,
+    previous=None,
+    max_age=0,
+    api_root=BOSTON_API_ROOT,
+    sync=True,
+    incremental=True,
+):
+    """
+    Get raw data for a resource that is at most max_age seconds old, with its
+    version token and sync time. Data another process has synced more recently
+    is picked up from the disk cache; data that is too old is synced with
+    Analyze Boston, starting from the newest version at hand.
+    Without sync, only the disk cache is read, whatever the age of its data.
+    Without incremental, for resources whose records are edited in place, data
+    is fetched whole and its version token hashes its content
+    """
+    base = previous
+    manifest = disk_cache.read_manifest(resource_id)
+    if manifest and (base is None or manifest["last_modified"] > base["synced_at"]):
+        df, manifest = disk_cache.read_frame(resource_id, manifest["etag"])
+        if df is not None:
+            base = {
+                "raw": df,
+                "etag": manifest["etag"],
+                "synced_at": manifest["last_modified"],
+            }
+    if base is not None and (not sync or time.time() - base["synced_at"] <= max_age):
+        return base
+    if not sync:
+        raise FileNotFoundError(f"no snapshot of {resource_id} in the disk cache")
+
+    if incremental:
+        df = sync_data(resource_id, base["raw"] if base else None, api_root)
+        etag = version_token(df)
+    else:
+        df = sync_data(resource_id, None, api_root)
+        etag = content_token(df)
+    manifest = disk_cache.write_frame(resource_id, df, etag)
+    return {"raw": df, "etag": manifest["etag"], "synced_at": manifest["last_modified"]}
+
+
+def load_enhanced(resource_id, etag, raw):
+    """
+    Get the enhanced data for a version of a resource, from the disk cache if
+    another process has already computed it
+    """
+    name = f"{resource_id}-enhanced"
+    enhanced_etag = f"{etag}-{ENHANCE_VERSION}"
+    enhanced, _ = disk_cache.read_frame(name, enhanced_etag)
+    if enhanced is None:
+        enhanced = enhance_dataframe(raw)
+        disk_cache.write_frame(name, enhanced, enhanced_etag)
+    return enhanced
+
+
+def read_aggregates(resource_id, etag):
+    """
+    Read the aggregates of a version of a resource from the disk cache, or
+    None if any of them is missing
+    """
+    aggs = {}
+    for key in aggregates.AGGREGATE_FRAMES:
+        frame, manifest = disk_cache.read_frame(f"{resource_id}-{key}", etag)
+        if frame is None:
+            return None
+        aggs[key] = frame
+    # the remaining aggregates are kept in the manifest of the last frame
+    aggs["rows"] = manifest["rows_aggregated"]
+    aggs["last_id"] = manifest["last_id"]
+    aggs["period_averages"] = {
+        unit: {
+            "period": pd.Timestamp(averages["period"]),
+            "current": _nan(averages["current"]),
+            "previous": _nan(averages["previous"]),
+        }
+        for unit, averages in manifest["period_averages"].items()
+    }
+    return aggs
+
+
+def write_aggregates(resource_id, etag, aggs):
+    """
+    Store the aggregates of a version of a resource in the disk cache
+    """
+    *frames, last = aggregates.AGGREGATE_FRAMES
+    for key in frames:
+        disk_cache.write_frame(f"{resource_id}-{key}", aggs[key], etag)
+    disk_cache.write_frame(
+        f"{resource_id}-{last}",
+        aggs[last],
+        etag,
+        rows_aggregated=aggs["rows"],
+        last_id=None if aggs["last_id"] is None else int(aggs["last_id"]),
+        period_averages={
+            unit: {
+                "period": averages["period"].isoformat(),
+                "current": _json_float(averages["current"]),
+                "previous": _json_float(averages["previous"]),
+            }
+            for unit, averages in aggs["period_averages"].items()
+        },
+    )
+
+
+def _json_float(value):
+    return None if math.isnan(value) else float(value)
+
+
+def _nan(value):
+    return math.nan if value is None else value
+
+
+def load_aggregates(resource_id, etag, df, scores, previous=None):
+    """
+    Get the aggregates for a version of a resource, from the disk cache if
+    another process has already computed them. Otherwise they are updated from
+    the previous aggregates, or computed from scratch
+    """
+    aggregates_etag = f"{etag}-{aggregates.AGGREGATES_VERSION}"
+    aggs = read_aggregates(resource_id, aggregates_etag)
+    if aggs is None:
+        if previous is None:
+            aggs = aggregates.materialize(df, scores)
+        else:
+            aggs = aggregates.update_aggregates(previous, df, scores)
+        write_aggregates(resource_id, aggregates_etag, aggs)
+    return aggs
+
+
+def load_snapshot(resource_id):
+    """
+    Get the snapshot of a resource last published to the disk cache, along with
+    its aggregates if they were published too, as the base of the next
+    version. Returns None when there is no snapshot
+    """
+    df, manifest = disk_cache.read_frame(resource_id)
+    if df is None:
+        return None
+    snapshot = {
+        "raw": df,
+        "etag": manifest["etag"],
+        "synced_at": manifest["last_modified"],
+    }
+    aggs = read_aggregates(
+        resource_id, f"{manifest['etag']}-{aggregates.AGGREGATES_VERSION}"
+    )
+    if aggs is not None:
+        snapshot["aggregates"] = aggs
+    return snapshot
+
+
+def derive_dataset(resource_id, raw, previous=None, cache=None, headless=False):
+    """
+    Derive the enhanced data, score index, rollups and aggregates from a raw
+    version. Rollups and aggregates are updated from the previous dataset, or
+    snapshot, rather than recomputed. Headless builds skip the rollups, which
+    only the app reads
+    """
+    cache = cache if cache is not None else MemoryCache()
+    etag = raw["etag"]
+    # a snapshot from load_snapshot holds none of the derived data to reuse
+    if previous is not None and previous["etag"] == etag and "df" in previous:
+        return dict(previous, synced_at=raw["synced_at"])
+
+    df = cache.get(
+        ("enhanced", resource_id, etag),
+        lambda: load_enhanced(resource_id, etag, raw["raw"]),
+    )
+    scores = cache.get(
+        ("score_index", resource_id, etag),
+        lambda: score_index.build_score_index(df),
+    )
+    # rolled up from the previous version, which only misses the newest rows
+    history = None
+    if not headless:
+        history = cache.get(
+            ("rollups", resource_id, etag),
+            lambda: rollups.update_rollups(
+                (previous or {}).get("rollups", rollups.empty_rollups()),
+                df,
+            ),
+        )
+    aggs = load_aggregates(
+        resource_id, etag, df, scores, (previous or {}).get("aggregates")
+    )
+    return {
+        "resource_id": resource_id,
+        **raw,
+        "df": df,
+        "scores": scores,
+        "rollups": history,
+        "aggregates": aggs,
+        "published_at": time.time(),
+    }
+
+
+@instrument.timed("dataset.build")
+def build_dataset(
+    resource_id,
+    previous=None,
+    max_age=0,
+    cache=None,
+    api_root=BOSTON_API_ROOT,
+    sync=True,
+):
+    """
+    Build a dataset for a resource whose data is at most max_age seconds old,
+    or from the newest snapshot in the disk cache without sync
+    """
+    raw = load_raw(resource_id, previous, max_age, api_root, sync)
+    return derive_dataset(resource_id, raw, previous, cache)
@@ -0,0 +1,102 @@
+# Metric definitions from the definitions resource on Analyze Boston
+# Definitions are a frame indexed by metric_name, so the scores join onto them by
+# key. The bundled metric_definitions fill in whatever the resource lacks
+
+import time
+import pandas as pd
+from .metric_definitions import metric_definitions
+
+DEFINITION_COLUMNS = ["metric_pretty", "metric_description"]
+# names the columns of the definitions resource may go by, once lowercased with
+# spaces replaced by underscores
+COLUMN_CANDIDATES = {
+    "metric_name": ["metric_name", "metric", "name"],
+    "metric_pretty": ["metric_pretty", "metric_pretty_name", "pretty_name", "title"],
+    "metric_description": ["metric_description", "description", "definition"],
+}
+NOT_AVAILABLE = "not available"
+
+
+def bundled_definitions():
+    """
+    Get the definitions bundled with the app, indexed by metric_name
+    """
+    return pd.DataFrame(metric_definitions).set_index("metric_name")
+
+
+def parse_definitions(raw):
+    """
+    Get the definitions held by a raw frame of the definitions resource, indexed
+    by metric_name. Returns None when the frame has no metric name column
+    """
+    columns = {
+        column: column.strip().lower().replace(" ", "_") for column in raw.columns
+    }
+    renames = {}
+    for name, candidates in COLUMN_CANDIDATES.items():
+        found = [c for c, normalized in columns.items() if normalized in candidates]
+        if found:
+            renames[found[0]] = name
+    if "metric_name" not in renames.values():
+        return None
+
+    parsed = raw[list(renames)].rename(columns=renames)
+    parsed["metric_name"] = parsed["metric_name"].astype(str).str.strip().str.upper()
+    return (
+        parsed.drop_duplicates(subset=["metric_name"], keep="last")
+        .set_index("metric_name")
+        .reindex(columns=DEFINITION_COLUMNS)
+        .replace({"": None})
+    )
+
+
+def definitions_frame(raw=None):
+    """
+    Build the definitions of every metric from a raw frame of the definitions
+    resource, falling back on the bundled ones. Metrics keep the bundled order,
+    followed by any the resource adds
+    """
+    bundled = bundled_definitions()
+    parsed = parse_definitions(raw) if raw is not None else None
+    if parsed is None:
+        return bundled
+    definitions = parsed.combine_first(bundled)
+    definitions = definitions.reindex(
+        bundled.index.append(definitions.index.difference(bundled.index))
+    )
+    definitions["metric_pretty"] = definitions["metric_pretty"].fillna(
+        definitions.index.to_series().str.title()
+    )
+    definitions["metric_description"] = definitions["metric_description"].fillna(
+        NOT_AVAILABLE
+    )
+    return definitions[DEFINITION_COLUMNS]
+
+
+def pretty_names(frame, definitions):
+    """
+    Relabel a frame indexed by metric_name with the pretty names of its metrics,
+    keeping the metric name of any metric without a definition
+    """
+    labels = definitions["metric_pretty"].reindex(frame.index)
+    labels = labels.fillna(pd.Series(frame.index, index=frame.index))
+    return frame.set_axis(pd.Index(labels, name=frame.index.name))
+
+
+def derive_definitions(resource_id, raw, previous=None, cache=None, headless=False):
+    """
+    Derive the definitions from a raw version of the definitions resource. raw
+    may hold no frame, for the bundled definitions
+    """
+    if (
+        previous is not None
+        and previous["etag"] == raw["etag"]
+        and "definitions" in previous
+    ):
+        return dict(previous, synced_at=raw["synced_at"])
+    return {
+        "resource_id": resource_id,
+        **raw,
+        "definitions": definitions_frame(raw["raw"]),
+        "published_at": time.time(),
+    }
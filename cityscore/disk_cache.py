@@ -0,0 +1,132 @@
+# On-disk cache of dataframes, shared by every app process on the host
+# Frames are stored as Arrow IPC files next to a JSON manifest describing them
+
+import glob
+import json
+import os
+import tempfile
+import time
+import uuid
+import pyarrow as pa
+import pyarrow.compute as pc
+from . import instrument
+
+CACHE_DIR = os.environ.get(
+    "CITYSCORE_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "cityscore")
+)
+# bump whenever the on-disk layout changes, so old caches are ignored
+CACHE_VERSION = 1
+# seconds before a data file no manifest points at is deleted. Another process
+# may have written it and not yet swapped in the manifest pointing at it
+ORPHAN_GRACE = 600
+
+
+def _manifest_path(name, cache_dir):
+    return os.path.join(cache_dir, f"{name}.json")
+
+
+def _atomic_write(path, write):
+    """
+    Write a file under a temporary name and swap it into place, so readers only
+    ever see complete files
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def read_manifest(name, cache_dir=CACHE_DIR):
+    """
+    Get the manifest of a cached frame, or None if there is no usable entry
+    """
+    try:
+        with open(_manifest_path(name, cache_dir)) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if manifest.get("cache_version") != CACHE_VERSION:
+        return None
+    return manifest
+
+
+@instrument.timed("disk_cache.read")
+def read_frame(name, etag=None, cache_dir=CACHE_DIR):
+    """
+    Read a cached frame through a memory map, along with its manifest. Numeric
+    and datetime columns are converted without a copy, so they stay backed by
+    the file's pages, which every process reading the file shares. Those
+    columns are read-only. Returns (None, None) on a miss, or when the entry's
+    etag does not match
+    """
+    manifest = read_manifest(name, cache_dir)
+    if manifest is None or (etag is not None and manifest["etag"] != etag):
+        instrument.count("disk_cache.misses")
+        return None, None
+    try:
+        # the mapping stays open for as long as the frame's columns use it
+        source = pa.memory_map(os.path.join(cache_dir, manifest["file"]))
+        df = pa.ipc.open_file(source).read_all().to_pandas(split_blocks=True)
+    except (OSError, pa.ArrowInvalid):
+        # replaced by another process between reading the manifest and the file
+        instrument.count("disk_cache.misses")
+        return None, None
+    instrument.count("disk_cache.hits")
+    return df, manifest
+
+
+@instrument.timed("disk_cache.write")
+def write_frame(name, df, etag, cache_dir=CACHE_DIR, **info):
+    """
+    Store a frame and swap in a new manifest pointing at it. Extra keyword
+    arguments are recorded in the manifest. Returns the manifest
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    table = pa.Table.from_pandas(df)
+    # Arrow turns NaN into nulls, which pandas can only read back by copying the
+    # column to put the NaN back, so store NaN as it is
+    for i, field in enumerate(table.schema):
+        if pa.types.is_floating(field.type) and table.column(i).null_count:
+            nan = pa.scalar(float("nan"), type=field.type)
+            table = table.set_column(i, field, pc.fill_null(table.column(i), nan))
+    data_file = f"{name}.{uuid.uuid4().hex}.arrow"
+
+    def write_table(f):
+        with pa.ipc.new_file(f, table.schema) as writer:
+            writer.write_table(table)
+
+    _atomic_write(os.path.join(cache_dir, data_file), write_table)
+    previous = read_manifest(name, cache_dir)
+    manifest = {
+        "cache_version": CACHE_VERSION,
+        "etag": etag,
+        "file": data_file,
+        "rows": len(df),
+        "last_modified": time.time(),
+        **info,
+    }
+    _atomic_write(
+        _manifest_path(name, cache_dir),
+        lambda f: f.write(json.dumps(manifest).encode()),
+    )
+
+    # drop the data file the manifest pointed at before, along with files left
+    # behind by writers that lost a race to swap in their manifest. Files other
+    # writers may be about to point at are left alone. Open memory maps keep
+    # working after their file is deleted
+    stale = {previous["file"]} if previous is not None else set()
+    now = time.time()
+    for path in glob.glob(os.path.join(cache_dir, f"{name}.*.arrow")):
+        data = os.path.basename(path)
+        if data == data_file:
+            continue
+        try:
+            if data in stale or now - os.path.getmtime(path) > ORPHAN_GRACE:
+                os.unlink(path)
+        except OSError:
+            pass
+    return manifest
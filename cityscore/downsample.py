@@ -0,0 +1,81 @@
+# Windowing and downsampling of time series, so charts stay within a point budget
+
+import numpy as np
+import pandas as pd
+
+# roughly one point per horizontal pixel of a wide chart
+MAX_CHART_POINTS = 1000
+ROWS_PER_PAGE = 100
+
+
+def window(df, column, start=None, end=None):
+    """
+    Get the rows of a frame sorted by column whose value falls between start and
+    end (inclusive), without scanning the whole frame
+    """
+    values = df[column]
+    first = 0 if start is None else values.searchsorted(pd.Timestamp(start), "left")
+    last = len(df) if end is None else values.searchsorted(pd.Timestamp(end), "right")
+    return df.iloc[first:last]
+
+
+def lttb(x, y, threshold):
+    """
+    Pick the indices of the points to keep when downsampling a series to
+    threshold points, using Largest-Triangle-Three-Buckets
+    (Steinarsson, 2013). The first and last points are always kept
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    # bucket the points between the first and last one
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    keep = np.empty(threshold, dtype=np.int64)
+    keep[0] = 0
+    keep[-1] = n - 1
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        # the next bucket is represented by its average point
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[end:next_end].mean()
+        avg_y = y[end:next_end].mean()
+        # keep the point making the largest triangle with the last kept point
+        ax, ay = x[keep[i]], y[keep[i]]
+        areas = np.abs(
+            (ax - avg_x) * (y[start:end] - ay) - (ax - x[start:end]) * (avg_y - ay)
+        )
+        keep[i + 1] = start + np.argmax(areas)
+    return keep
+
+
+def downsample(df, x_column, y_column, max_points=MAX_CHART_POINTS):
+    """
+    Downsample a frame sorted by x_column to at most max_points rows, keeping
+    the shape of the y_column series. Small frames are returned as they are
+    """
+    if len(df) <= max_points:
+        return df
+    df = df.dropna(subset=[y_column])
+    x = df[x_column].to_numpy().astype("datetime64[ns]").astype(np.float64)
+    y = df[y_column].to_numpy(dtype=np.float64)
+    return df.iloc[lttb(x, y, max_points)]
+
+
+def page(rows, page_number, rows_per_page=ROWS_PER_PAGE):
+    """
+    Get one page of rows from a frame, or from a sequence of row positions,
+    numbering pages from 1
+    """
+    start = (page_number - 1) * rows_per_page
+    if isinstance(rows, pd.DataFrame):
+        return rows.iloc[start : start + rows_per_page]
+    return rows[start : start + rows_per_page]
+
+
+def page_count(rows, rows_per_page=ROWS_PER_PAGE):
+    """
+    Get the number of pages needed to show every row of a frame, or every
+    position of a sequence of row positions
+    """
+    return max(1, -(-len(rows) // rows_per_page))
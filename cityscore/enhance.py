@@ -0,0 +1,141 @@
+# Datatypes and derived features for the CityScore Full Metrics dataset
+
+import sys
+import time
+import numpy as np
+import pandas as pd
+from . import instrument
+
+TIME_UNITS = ["day", "week", "month", "quarter"]
+# bump whenever enhance_dataframe changes its output, to invalidate cached copies
+ENHANCE_VERSION = 2
+
+# target datatype of every column that needs converting from the raw text.
+# scores only need a few significant digits, so they are stored as float32;
+# target is shown to users as is, so it stays float64
+column_schema = {
+    "metric_name": "category",
+    "score_calculated_ts": "datetime64[ns]",
+    "target": "float64",
+    **{
+        f"{unit}_{column}": dtype
+        for unit in TIME_UNITS
+        for column, dtype in [
+            ("score", "float32"),
+            ("numerator", "float64"),
+            ("denominator", "float64"),
+        ]
+    },
+    "latest_score_flag": "bool",
+}
+
+
+@instrument.timed("enhance.convert")
+def convert_columns(df, schema=column_schema):
+    """
+    Convert columns to the datatypes in the schema. Numeric columns are parsed
+    together, one pass per datatype, so each group ends up in a single block
+    """
+    float_groups = {}
+    for column, dtype in schema.items():
+        if column in df.columns and pd.api.types.is_float_dtype(dtype):
+            float_groups.setdefault(dtype, []).append(column)
+
+    converted = []
+    for dtype, columns in float_groups.items():
+        values = pd.to_numeric(df[columns].to_numpy().ravel(), errors="coerce")
+        converted.append(
+            pd.DataFrame(
+                values.reshape(len(df), len(columns)).astype(dtype),
+                index=df.index,
+                columns=columns,
+            )
+        )
+    converted_columns = [c for columns in float_groups.values() for c in columns]
+    result = pd.concat([df.drop(columns=converted_columns), *converted], axis=1)
+
+    for column, dtype in schema.items():
+        if column not in result.columns or column in converted_columns:
+            continue
+        if dtype == "datetime64[ns]":
+            result[column] = pd.to_datetime(result[column])
+        elif dtype == "bool":
+            result[column] = result[column].astype(int).astype(bool)
+        else:
+            result[column] = result[column].astype(dtype)
+    return result[df.columns]
+
+
+@instrument.timed("enhance.periods")
+def add_periods(df):
+    """
+    Add the day, week, month and quarter each score covers, plus the year.
+    Scores are calculated the morning after the day they cover, weeks start on
+    Sunday, and each period is the one before the period holding that day
+    """
+    ts = df["score_calculated_ts"]
+    if ts.dt.tz is not None:
+        ts = ts.dt.tz_localize(None)
+    day = (ts.dt.normalize() - pd.Timedelta(days=1)).to_numpy()
+
+    days = day.astype("datetime64[D]")
+    # 1970-01-01 was a Thursday, four days after a Sunday
+    days_since_sunday = (days.astype(np.int64) + 4) % 7
+    months = day.astype("datetime64[M]")
+    quarter_start = months - months.astype(np.int64) % 3
+
+    df["day"] = day
+    df["week"] = (days - days_since_sunday - 7).astype("datetime64[ns]")
+    df["month"] = (months - 1).astype("datetime64[ns]")
+    df["quarter"] = (quarter_start.astype("datetime64[D]") - 1).astype("datetime64[ns]")
+    df["year"] = df["day"].dt.year
+    return df
+
+
+@instrument.timed("enhance")
+def enhance_dataframe(df):
+    """
+    Fix datatypes and add features for the CityScore Full Metrics dataset
+    """
+    instrument.count("enhance.rows", len(df))
+    # set id as index
+    df = df.set_index("_id")
+    df = convert_columns(df)
+    return add_periods(df)
+
+
+def profile_enhance(df):
+    """
+    Report the time enhance_dataframe takes on a raw frame and the memory it
+    saves, compared with the raw frame and with pandas' default datatypes
+    """
+    start = time.perf_counter()
+    enhanced = enhance_dataframe(df)
+    seconds = time.perf_counter() - start
+
+    default_dtypes = {
+        column: "object" if dtype.name == "category" else "float64"
+        for column, dtype in enhanced.dtypes.items()
+        if dtype.name in ("category", "float32")
+    }
+    mb = 1024 * 1024
+    return {
+        "rows": len(df),
+        "seconds": round(seconds, 3),
+        "raw_mb": round(df.memory_usage(deep=True).sum() / mb, 2),
+        "default_dtypes_mb": round(
+            enhanced.astype(default_dtypes).memory_usage(deep=True).sum() / mb, 2
+        ),
+        "enhanced_mb": round(enhanced.memory_usage(deep=True).sum() / mb, 2),
+    }
+
+
+if __name__ == "__main__":
+    # usage: python -m cityscore.enhance [resource_id]
+    from .ckan import fetch_data
+
+    resource_id = (
+        sys.argv[1] if len(sys.argv) > 1 else "dd657c02-3443-4c00-8b29-56a40cfe7ee4"
+    )
+    for key, value in profile_enhance(fetch_data(resource_id)).items():
+        print(f"{key}: {value}")
@@ -0,0 +1,132 @@
+# Chunked export of dataframes to CSV, gzipped CSV and Parquet
+# Each format is produced as an iterator of bytes, so an export never needs a
+# second full copy of the data in memory before it is written out
+
+import zlib
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+CHUNK_ROWS = 10000
+FORMATS = {
+    "CSV": {"extension": "csv", "mime": "text/csv"},
+    "CSV (gzip)": {"extension": "csv.gz", "mime": "application/gzip"},
+    "Parquet": {"extension": "parquet", "mime": "application/octet-stream"},
+}
+
+
+def filter_rows(df, start=None, end=None, date_column="day"):
+    """
+    Get the positions of the rows between two dates (inclusive), or None when
+    that is every row
+    """
+    if start is None and end is None:
+        return None
+    dates = df[date_column]
+    mask = dates.notna()
+    if start is not None:
+        mask &= dates >= start
+    if end is not None:
+        mask &= dates <= end
+    return None if mask.all() else np.flatnonzero(mask.to_numpy())
+
+
+def filter_frame(df, columns=None, start=None, end=None, date_column="day"):
+    """
+    Select the columns and the rows between two dates (inclusive) to export.
+    The frame itself is returned, without a copy, when that selects everything
+    """
+    rows = filter_rows(df, start, end, date_column)
+    if rows is not None:
+        df = df.iloc[rows]
+    if columns is not None and list(columns) != list(df.columns):
+        df = df[columns]
+    return df
+
+
+def iter_chunks(df, chunk_rows=CHUNK_ROWS):
+    """
+    Split a frame into consecutive chunks of rows
+    """
+    for start in range(0, max(len(df), 1), chunk_rows):
+        yield df.iloc[start : start + chunk_rows]
+
+
+def iter_csv(df, chunk_rows=CHUNK_ROWS):
+    """
+    Write a frame as UTF-8 CSV, one chunk of rows at a time
+    """
+    for i, chunk in enumerate(iter_chunks(df, chunk_rows)):
+        yield chunk.to_csv(header=i == 0).encode("utf-8")
+
+
+def iter_gzip(chunks):
+    """
+    Gzip a stream of bytes
+    """
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+class _ChunkSink:
+    """
+    File-like object collecting what is written to it until it is drained
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.closed = False
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def iter_parquet(df, chunk_rows=CHUNK_ROWS):
+    """
+    Write a frame as Parquet, one row group per chunk of rows
+    """
+    sink = _ChunkSink()
+    schema = pa.Schema.from_pandas(df)
+    with pq.ParquetWriter(sink, schema) as writer:
+        for chunk in iter_chunks(df, chunk_rows):
+            writer.write_table(pa.Table.from_pandas(chunk, schema=schema))
+            yield sink.drain()
+    yield sink.drain()
+
+
+def iter_export(df, export_format, chunk_rows=CHUNK_ROWS):
+    """
+    Write a frame in one of the export FORMATS, as an iterator of bytes
+    """
+    if export_format == "CSV":
+        return iter_csv(df, chunk_rows)
+    if export_format == "CSV (gzip)":
+        return iter_gzip(iter_csv(df, chunk_rows))
+    if export_format == "Parquet":
+        return iter_parquet(df, chunk_rows)
+    raise ValueError(f"Unknown export format: {export_format}")
+
+
+def write_export(df, path, export_format, chunk_rows=CHUNK_ROWS):
+    """
+    Write a frame to a file in one of the export FORMATS
+    """
+    with open(path, "wb") as f:
+        for chunk in iter_export(df, export_format, chunk_rows):
+            f.write(chunk)
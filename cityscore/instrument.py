@@ -0,0 +1,182 @@
+# Span timers and counters for the hot paths of the app
+# Engine code records into the process-wide registry; every script run keeps
+# its own registry too, so a slow page can be told apart from a slow process
+
+from contextlib import contextmanager
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+PREFIX = "cityscore"
+
+
+class Metrics:
+    """
+    Thread-safe registry of counters and span timings. Everything recorded
+    is also recorded in the parent registry, if there is one
+    """
+
+    def __init__(self, parent=None):
+        self.parent = parent
+        self._lock = threading.Lock()
+        self._counters = {}
+        # span name -> [count, total seconds, max seconds]
+        self._spans = {}
+
+    def count(self, name, amount=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+        if self.parent is not None:
+            self.parent.count(name, amount)
+
+    def record(self, name, seconds):
+        with self._lock:
+            span = self._spans.setdefault(name, [0, 0.0, 0.0])
+            span[0] += 1
+            span[1] += seconds
+            span[2] = max(span[2], seconds)
+        if self.parent is not None:
+            self.parent.record(name, seconds)
+
+    @contextmanager
+    def span(self, name):
+        """
+        Time the body of a with block as a span called name
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def snapshot(self):
+        """
+        Get copies of the counters and of the spans, as dicts of count, seconds
+        and max_seconds
+        """
+        with self._lock:
+            return {
+                "counters": dict(self._counters),
+                "spans": {
+                    name: {"count": count, "seconds": seconds, "max_seconds": most}
+                    for name, (count, seconds, most) in self._spans.items()
+                },
+            }
+
+
+# registry shared by everything in the process
+metrics = Metrics()
+
+
+def count(name, amount=1):
+    metrics.count(name, amount)
+
+
+def span(name):
+    return metrics.span(name)
+
+
+def timed(name):
+    """
+    Decorator recording every call of a function as a span called name
+    """
+
+    def decorate(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            with metrics.span(name):
+                return f(*args, **kwargs)
+
+        return wrapper
+
+    return decorate
+
+
+def _metric_name(name):
+    return f"{PREFIX}_{name.replace('.', '_').replace('-', '_')}"
+
+
+def prometheus_text(snapshot, extra=None):
+    """
+    Format a registry snapshot in the Prometheus text exposition format, along
+    with extra values kept outside the registry: a dict holding "counters"
+    (values that only ever increase) and "gauges", each a dict of name -> value
+    """
+    extra = extra or {}
+    lines = []
+    counters = {**snapshot["counters"], **extra.get("counters", {})}
+    for name, value in sorted(counters.items()):
+        metric = _metric_name(name) + "_total"
+        lines += [f"# TYPE {metric} counter", f"{metric} {value}"]
+    spans = sorted(snapshot["spans"].items())
+    if spans:
+        metric = f"{PREFIX}_span_seconds"
+        lines.append(f"# TYPE {metric} summary")
+        for name, span in spans:
+            lines.append(f'{metric}_count{{span="{name}"}} {span["count"]}')
+            lines.append(f'{metric}_sum{{span="{name}"}} {span["seconds"]:.6f}')
+        lines.append(f"# TYPE {metric}_max gauge")
+        for name, span in spans:
+            lines.append(f'{metric}_max{{span="{name}"}} {span["max_seconds"]:.6f}')
+    for name, value in sorted(extra.get("gauges", {}).items()):
+        metric = _metric_name(name)
+        lines += [f"# TYPE {metric} gauge", f"{metric} {value}"]
+    return "\n".join(lines) + "\n"
+
+
+def log_line(snapshot, **fields):
+    """
+    Format a registry snapshot as a single key=value log line, with the span
+    times in milliseconds
+    """
+    parts = [f"{key}={value}" for key, value in fields.items()]
+    parts += [f"{name}={value}" for name, value in sorted(snapshot["counters"].items())]
+    parts += [
+        f"{name}_ms={span['seconds'] * 1000:.1f}"
+        for name, span in sorted(snapshot["spans"].items())
+    ]
+    return " ".join(parts)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = prometheus_text(metrics.snapshot(), self.server.extra()).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def serve_metrics(port, extra=dict):
+    """
+    Serve the process-wide registry at /metrics on port, from a background
+    thread. extra is called on every scrape for extra values to report, as
+    taken by prometheus_text.
+    Only the first call in a process starts a server
+    """
+    global _server
+    with _server_lock:
+        if _server is None:
+            _server = ThreadingHTTPServer(("", port), _MetricsHandler)
+            _server.daemon_threads = True
+            _server.extra = extra
+            threading.Thread(
+                target=_server.serve_forever, name="metrics-server", daemon=True
+            ).start()
+            logger.info("serving metrics on port %d", port)
+        return _server
@@ -0,0 +1,115 @@
+# In-memory cache with a byte budget and LRU eviction
+# Entries are keyed on cheap tokens (e.g. a resource's version token) instead of
+# hashing their inputs, and the cache keeps counters to help size the budget
+
+from collections import OrderedDict
+import logging
+import os
+import sys
+import threading
+import time
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+MAX_BYTES = int(os.environ.get("CITYSCORE_MEMORY_CACHE_BYTES", 512 * 1024 * 1024))
+
+
+def sizeof(value):
+    """
+    Estimate how many bytes a cached value takes up
+    """
+    if isinstance(value, (pd.DataFrame, pd.Series, pd.Index)):
+        usage = value.memory_usage(deep=True)
+        return int(usage.sum() if isinstance(usage, pd.Series) else usage)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(
+            sizeof(k) + sizeof(v) for k, v in value.items()
+        )
+    if isinstance(value, (list, tuple, set)):
+        return sys.getsizeof(value) + sum(sizeof(v) for v in value)
+    return sys.getsizeof(value)
+
+
+class MemoryCache:
+    """
+    Thread-safe cache holding at most max_bytes of values, evicting the least
+    recently used entries first
+    """
+
+    def __init__(self, max_bytes=MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+        self._counters = {
+            "hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "key_seconds": 0.0,
+            "compute_seconds": 0.0,
+        }
+
+    def get(self, key, compute):
+        """
+        Get the value cached under key, calling compute to create it on a miss.
+        key is either a hashable token or a function returning one, in which
+        case the time spent building it is counted as key_seconds
+        """
+        if callable(key):
+            start = time.perf_counter()
+            key = key()
+            self._count("key_seconds", time.perf_counter() - start)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self._counters["hits"] += 1
+                return self._entries[key][0]
+            self._counters["misses"] += 1
+
+        start = time.perf_counter()
+        value = compute()
+        self._count("compute_seconds", time.perf_counter() - start)
+        self.put(key, value)
+        return value
+
+    def put(self, key, value):
+        """
+        Cache a value, evicting older entries until it fits in the budget.
+        Values bigger than the whole budget are not cached
+        """
+        size = sizeof(value)
+        if size > self.max_bytes:
+            logger.warning(
+                "not caching %s: %d bytes is over the %d byte budget",
+                key,
+                size,
+                self.max_bytes,
+            )
+            return
+        with self._lock:
+            if key in self._entries:
+                self._nbytes -= self._entries.pop(key)[1]
+            while self._entries and self._nbytes + size > self.max_bytes:
+                evicted, (_, evicted_size) = self._entries.popitem(last=False)
+                self._nbytes -= evicted_size
+                self._counters["evictions"] += 1
+                logger.info("evicted %s from the memory cache", evicted)
+            self._entries[key] = (value, size)
+            self._nbytes += size
+
+    def _count(self, counter, amount):
+        with self._lock:
+            self._counters[counter] += amount
+
+    def stats(self):
+        """
+        Get the cache's counters along with its current size
+        """
+        with self._lock:
+            return {
+                **self._counters,
+                "entries": len(self._entries),
+                "bytes": self._nbytes,
+                "max_bytes": self.max_bytes,
+            }
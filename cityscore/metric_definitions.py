@@ -1,4 +1,5 @@
 # Metric Definitions
+# bundled copy, filling in whatever the definitions resource lacks
 # source: https://data.boston.gov/dataset/cityscore/resource/db7b8b86-5c35-45b2-9276-5a6527ae6edc
 
 metric_definitions = [
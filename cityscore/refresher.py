@@ -0,0 +1,130 @@
+# Background refresh of published datasets
+# Readers always get the last published dataset right away, while a worker
+# thread builds the next one and swaps it in once it is complete
+
+import logging
+import threading
+import time
+from .backoff import backoff_delay
+
+logger = logging.getLogger(__name__)
+
+# refreshers shared by every session in the process, by key
+_refreshers = {}
+_refreshers_lock = threading.Lock()
+
+REFRESH_INTERVAL = 60 * 60
+MAX_ATTEMPTS = 5
+BACKOFF_BASE = 2
+BACKOFF_MAX = 5 * 60
+
+
+class Refresher:
+    """
+    Publishes datasets built by build(previous, max_age) and rebuilds them
+    on a background thread once they are interval seconds old.
+    Datasets are dicts with a "synced_at" timestamp
+    """
+
+    def __init__(
+        self,
+        build,
+        interval=REFRESH_INTERVAL,
+        max_attempts=MAX_ATTEMPTS,
+        backoff_base=BACKOFF_BASE,
+    ):
+        self.build = build
+        self.interval = interval
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self._dataset = None
+        self._error = None
+        self._published = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """
+        Start the background thread, unless it is already running
+        """
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(
+                target=self._run, name="dataset-refresher", daemon=True
+            )
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def get(self, timeout=None):
+        """
+        Get the published dataset, however old it is. Only waits when nothing
+        has been published yet, and raises the last error if building the
+        first dataset failed
+        """
+        if not self._published.wait(timeout):
+            raise TimeoutError("no dataset has been published yet")
+        if self._dataset is None:
+            raise self._error
+        return self._dataset
+
+    def refresh(self, max_age=0):
+        """
+        Build a new dataset from the published one and publish it, retrying with
+        backoff. Readers keep getting the published dataset until the new one
+        is swapped in. Returns whether a dataset was published
+        """
+        for attempt in range(self.max_attempts):
+            try:
+                dataset = self.build(self._dataset, max_age)
+            except Exception as e:
+                self._error = e
+                logger.warning(
+                    "refresh attempt %d of %d failed: %s",
+                    attempt + 1,
+                    self.max_attempts,
+                    e,
+                )
+                if attempt + 1 < self.max_attempts and not self._stop.wait(
+                    backoff_delay(attempt, self.backoff_base, BACKOFF_MAX)
+                ):
+                    continue
+                break
+            # assigning the reference is atomic, so readers see either version
+            self._dataset = dataset
+            self._error = None
+            self._published.set()
+            return True
+        logger.error("refresh failed, serving the data published before")
+        # let readers waiting on the first dataset see the error
+        self._published.set()
+        return False
+
+    def _run(self):
+        # start from whatever data is at hand, however old, then revalidate it
+        published = self.refresh(max_age=float("inf"))
+        min_wait = 0
+        while True:
+            if published:
+                age = time.time() - self._dataset["synced_at"]
+                wait = max(min_wait, self.interval - age)
+            else:
+                wait = min(BACKOFF_MAX, self.backoff_base * 2**self.max_attempts)
+            if self._stop.wait(wait):
+                return
+            published = self.refresh(max_age=self.interval / 2)
+            # data still old after revalidating has no newer version yet (e.g. it
+            # is read from snapshots), so check again later rather than right away
+            min_wait = self.interval / 2
+
+
+def shared_refresher(key, build, **kwargs):
+    """
+    Get the process-wide refresher for key, creating and starting it on first
+    use. Keyword arguments are passed on to Refresher
+    """
+    with _refreshers_lock:
+        if key not in _refreshers:
+            _refreshers[key] = Refresher(build, **kwargs).start()
+        return _refreshers[key]
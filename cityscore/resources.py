@@ -0,0 +1,112 @@
+# The Analyze Boston resources the app reads, and a fetch engine building any
+# set of them concurrently. Every resource is synced and cached on its own,
+# under its resource id, so a slow or failing one does not hold up the others
+
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import time
+from .ckan import BOSTON_API_ROOT
+from .dataset import derive_dataset, load_raw
+from .definitions import derive_definitions
+
+logger = logging.getLogger(__name__)
+
+CITYSCORE_FULLMETRICS = "dd657c02-3443-4c00-8b29-56a40cfe7ee4"
+METRIC_DEFINITIONS = "db7b8b86-5c35-45b2-9276-5a6527ae6edc"
+DEFAULT_RESOURCES = [CITYSCORE_FULLMETRICS, METRIC_DEFINITIONS]
+MAX_WORKERS = 4
+
+# how each resource is derived from its raw data; others are kept raw
+DERIVE = {
+    CITYSCORE_FULLMETRICS: derive_dataset,
+    METRIC_DEFINITIONS: derive_definitions,
+}
+# resources the app bundles a copy of, used when they cannot be loaded at first
+BUNDLED = {METRIC_DEFINITIONS}
+# small resources whose records are edited in place, so they are fetched whole
+# on every sync rather than from the highest _id held
+REFETCH = {METRIC_DEFINITIONS}
+
+
+def derive_raw(resource_id, raw, previous=None, cache=None, headless=False):
+    """
+    Wrap a raw version of a resource that needs nothing derived from it
+    """
+    return {"resource_id": resource_id, **raw, "published_at": time.time()}
+
+
+def build_resource(
+    resource_id,
+    previous=None,
+    max_age=0,
+    cache=None,
+    api_root=BOSTON_API_ROOT,
+    sync=True,
+    use_bundled=True,
+    headless=False,
+):
+    """
+    Build a dataset for any resource whose data is at most max_age seconds old,
+    deriving from it whatever DERIVE lists for the resource. With use_bundled,
+    bundled resources fall back on their bundled copy when they cannot be
+    loaded at first. Headless builds skip what only the app reads
+    """
+    try:
+        raw = load_raw(
+            resource_id,
+            previous,
+            max_age,
+            api_root,
+            sync,
+            incremental=resource_id not in REFETCH,
+        )
+    except Exception as e:
+        if not use_bundled or previous is not None or resource_id not in BUNDLED:
+            raise
+        logger.warning("using the bundled copy of %s: %s", resource_id, e)
+        # stamped as never synced, so the refresher revalidates it right away
+        raw = {"raw": None, "etag": "bundled", "synced_at": 0}
+    derive = DERIVE.get(resource_id, derive_raw)
+    return derive(resource_id, raw, previous, cache, headless)
+
+
+def build_resources(
+    resource_ids=DEFAULT_RESOURCES,
+    previous=None,
+    max_age=0,
+    cache=None,
+    api_root=BOSTON_API_ROOT,
+    sync=True,
+    use_bundled=True,
+    headless=False,
+    max_workers=MAX_WORKERS,
+):
+    """
+    Build datasets for several resources concurrently, each from its previous
+    dataset in previous (a dict by resource id) if there is one.
+    Returns the datasets and the errors of the resources that failed, as
+    dicts by resource id
+    """
+    previous = previous or {}
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {
+            resource_id: pool.submit(
+                build_resource,
+                resource_id,
+                previous.get(resource_id),
+                max_age,
+                cache,
+                api_root,
+                sync,
+                use_bundled,
+                headless,
+            )
+            for resource_id in resource_ids
+        }
+    datasets, errors = {}, {}
+    for resource_id, future in futures.items():
+        try:
+            datasets[resource_id] = future.result()
+        except Exception as e:
+            errors[resource_id] = e
+    return datasets, errors
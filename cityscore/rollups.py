@@ -0,0 +1,163 @@
+# Rollups of the scores of every metric, one row per (metric, period) for each
+# time unit, held in compact arrays sorted by metric and period so the history
+# of any metric is a slice. Rollups are updated from the rows added since the
+# last version rather than rebuilt
+
+import numpy as np
+import pandas as pd
+from . import aggregates
+from . import instrument
+from .downsample import downsample, window
+from .enhance import TIME_UNITS
+
+
+def empty_rollups():
+    """
+    Get rollups holding no rows
+    """
+    return {
+        "rows": 0,
+        "last_id": None,
+        "metrics": pd.Index([], dtype=object),
+        "targets": np.array([], dtype="float64"),
+        "units": {
+            unit: {
+                "metric": np.array([], dtype="int32"),
+                "period": np.array([], dtype="datetime64[ns]"),
+                "score": np.array([], dtype="float32"),
+                "starts": np.zeros(1, dtype="int64"),
+            }
+            for unit in TIME_UNITS
+        },
+    }
+
+
+def _merge(rollup, codes, periods, scores, n_metrics):
+    """
+    Merge new rows into the rollup of a time unit. A (metric, period) keeps the
+    score it was last given, unless that score is missing and an earlier one is not
+    """
+    codes = np.concatenate([rollup["metric"], codes])
+    periods = np.concatenate([rollup["period"], periods])
+    scores = np.concatenate([rollup["score"], scores])
+    position = np.arange(len(codes))
+    # sort by metric, then period, then missing scores before present ones, and
+    # then in the order the scores were given, so the last row of a group wins
+    order = np.lexsort((position, ~np.isnan(scores), periods, codes))
+    codes, periods, scores = codes[order], periods[order], scores[order]
+    last = np.ones(len(codes), dtype=bool)
+    last[:-1] = (codes[1:] != codes[:-1]) | (periods[1:] != periods[:-1])
+    codes = codes[last]
+    return {
+        "metric": codes,
+        "period": periods[last],
+        "score": scores[last],
+        "starts": np.searchsorted(codes, np.arange(n_metrics + 1)).astype("int64"),
+    }
+
+
+def _add_rows(rollups, df):
+    """
+    Get rollups with the rows of an enhanced dataframe added
+    """
+    names = df["metric_name"].astype(str)
+    metrics = rollups["metrics"]
+    metrics = metrics.append(pd.Index(names.unique()).difference(metrics))
+    codes = metrics.get_indexer(names).astype("int32")
+
+    targets = np.full(len(metrics), np.nan)
+    targets[: len(rollups["targets"])] = rollups["targets"]
+    # the same rule as the metric info shown on About the Metrics
+    latest = aggregates.latest_values(df, ["target"])["target"].dropna()
+    targets[metrics.get_indexer(latest.index)] = latest.to_numpy()
+
+    units = {
+        unit: _merge(
+            rollups["units"][unit],
+            codes,
+            df[unit].to_numpy(dtype="datetime64[ns]"),
+            df[f"{unit}_score"].to_numpy(dtype="float32"),
+            len(metrics),
+        )
+        for unit in TIME_UNITS
+    }
+    return {
+        "rows": rollups["rows"] + len(df),
+        "last_id": df.index[-1] if len(df) else rollups["last_id"],
+        "metrics": metrics,
+        "targets": targets,
+        "units": units,
+    }
+
+
+@instrument.timed("rollups.build")
+def build_rollups(df):
+    """
+    Build the rollups of an enhanced CityScore dataframe
+    """
+    return _add_rows(empty_rollups(), df)
+
+
+@instrument.timed("rollups.update")
+def update_rollups(rollups, df):
+    """
+    Bring rollups up to date with a newer version of the dataframe. When the new
+    version only appends rows, only those rows are rolled up; otherwise the
+    rollups are rebuilt
+    """
+    rows = rollups["rows"]
+    if rows == 0 or len(df) < rows or df.index[rows - 1] != rollups["last_id"]:
+        return build_rollups(df)
+    if len(df) == rows:
+        return rollups
+    return _add_rows(rollups, df.iloc[rows:])
+
+
+def series(rollups, unit, metric_name):
+    """
+    Get the score of a metric for every period of a time unit, oldest first
+    """
+    code = rollups["metrics"].get_indexer([metric_name])[0]
+    rollup = rollups["units"][unit]
+    if code < 0:
+        return pd.DataFrame(columns=[unit, f"{unit}_score"])
+    rows = slice(rollup["starts"][code], rollup["starts"][code + 1])
+    return pd.DataFrame(
+        {unit: rollup["period"][rows], f"{unit}_score": rollup["score"][rows]}
+    )
+
+
+def target(rollups, metric_name):
+    """
+    Get the latest target given for a metric, or NaN if it has none
+    """
+    code = rollups["metrics"].get_indexer([metric_name])[0]
+    return float(rollups["targets"][code]) if code >= 0 else float("nan")
+
+
+def compare(
+    rollups,
+    unit,
+    metric_names,
+    start=None,
+    end=None,
+    max_points=None,
+    labels=None,
+):
+    """
+    Get the scores of several metrics between start and end, as one long frame
+    with a metric_name column holding labels (the metric names by default).
+    If max_points is given, the metrics share that many points between them
+    """
+    score = f"{unit}_score"
+    frames = []
+    for metric_name, label in zip(metric_names, labels or metric_names):
+        history = window(series(rollups, unit, metric_name), unit, start, end)
+        if max_points is not None:
+            # downsampling keeps at least 3 points of a series
+            budget = max(max_points // len(metric_names), 3)
+            history = downsample(history, unit, score, budget)
+        frames.append(history.assign(metric_name=label))
+    if not frames:
+        return pd.DataFrame(columns=[unit, score, "metric_name"])
+    return pd.concat(frames, ignore_index=True)
@@ -0,0 +1,77 @@
+# Index of deduplicated scores keyed by (metric_name, time_unit, period)
+# Built once per version of the data, so page reruns only do lookups
+
+import pandas as pd
+from .enhance import TIME_UNITS
+from . import instrument
+
+LATEST_COLUMNS = ["metric_name", "score_calculated_ts"] + [
+    column for unit in TIME_UNITS for column in (unit, f"{unit}_score")
+]
+# how far back the period before a given period starts, for each time unit
+PREVIOUS_PERIOD = {
+    "day": pd.DateOffset(days=1),
+    "week": pd.DateOffset(weeks=1),
+    "month": pd.DateOffset(months=1),
+    # quarters are labelled by their last day
+    "quarter": pd.offsets.QuarterEnd(),
+}
+
+
+@instrument.timed("score_index.build")
+def build_score_index(df):
+    """
+    Build the score index for an enhanced CityScore dataframe
+    """
+    latest = (
+        df.loc[df["latest_score_flag"], LATEST_COLUMNS]
+        .reset_index(drop=True)
+        .sort_values(by=["metric_name"])
+    )
+    index = {"latest": latest, "current": {}, "periods": {}}
+    for unit in TIME_UNITS:
+        score = f"{unit}_score"
+        scores = df[["metric_name", unit, score]].drop_duplicates()
+        index["current"][unit] = latest[unit].max()
+        index["periods"][unit] = {
+            period: frame.set_index("metric_name")[score]
+            for period, frame in scores.groupby(unit)
+        }
+    return index
+
+
+def current_period(index, unit):
+    """
+    Get the most recent period with scores for a time unit
+    """
+    return index["current"][unit]
+
+
+def previous_period(unit, period):
+    """
+    Get the period before a given period
+    """
+    return period - PREVIOUS_PERIOD[unit]
+
+
+def latest_scores(index):
+    """
+    Get the latest scores of every metric, one row per metric
+    """
+    return index["latest"]
+
+
+def period_scores(index, unit, period):
+    """
+    Get the scores of every metric for a period, as a series indexed by
+    metric_name. A metric has more than one score for a period when it was
+    recalculated while the period was still running
+    """
+    return index["periods"][unit].get(period, pd.Series(dtype="float32"))
+
+
+def period_average(index, unit, period):
+    """
+    Get the average score across metrics for a period
+    """
+    return float(period_scores(index, unit, period).mean())
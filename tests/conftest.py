@@ -0,0 +1,7 @@
+# Keep the disk cache of every test run in a fresh directory. The cache
+# directory is read when cityscore is first imported, so it is set here
+
+import os
+import tempfile
+
+os.environ["CITYSCORE_CACHE_DIR"] = tempfile.mkdtemp(prefix="cityscore-tests-")
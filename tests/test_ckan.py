@@ -0,0 +1,77 @@
+# Tests of syncing data incrementally against a local datastore
+
+import pytest
+from benchmarks.ckan_fixture import FixtureServer, synthetic_frame
+from cityscore.ckan import fetch_data, sync_data
+from cityscore.metric_definitions import metric_definitions
+
+RESOURCE_ID = "dd657c02-3443-4c00-8b29-56a40cfe7ee4"
+METRICS = len(metric_definitions)
+DAYS = 200
+NEW_DAYS = 70
+
+
+def flag_latest(df):
+    """
+    Flag the scores of the last day of a frame as the latest ones
+    """
+    df = df.copy()
+    df["latest_score_flag"] = "0"
+    df.iloc[-METRICS:, df.columns.get_loc("latest_score_flag")] = "1"
+    return df
+
+
+@pytest.fixture(scope="module")
+def raw():
+    return flag_latest(synthetic_frame().iloc[: DAYS * METRICS])
+
+
+@pytest.fixture(scope="module")
+def held(raw):
+    """
+    The data as fetched before the last NEW_DAYS days were added
+    """
+    with FixtureServer(flag_latest(raw.iloc[: -NEW_DAYS * METRICS])) as server:
+        return fetch_data(RESOURCE_ID, server.url)
+
+
+def test_sync_appends_new_records(raw, held):
+    with FixtureServer(raw) as server:
+        df = sync_data(RESOURCE_ID, held, server.url)
+        # one page of new records, one empty page, and the total
+        assert server.requests == 3
+    assert df["_id"].tolist() == raw["_id"].tolist()
+    assert df["day_score"].tolist() == raw["day_score"].tolist()
+
+
+def test_sync_supersedes_latest_scores(raw, held):
+    with FixtureServer(raw) as server:
+        df = sync_data(RESOURCE_ID, held, server.url)
+    assert (
+        df["latest_score_flag"].tolist()
+        == raw["latest_score_flag"].astype(int).tolist()
+    )
+    assert (df.groupby("metric_name")["latest_score_flag"].sum() == 1).all()
+
+
+def test_sync_pages_through_capped_server(raw, held):
+    with FixtureServer(raw, rows_max=1000) as server:
+        df = sync_data(RESOURCE_ID, held, server.url)
+        # two pages of new records, the second shorter than the first, and the
+        # total; no full fetch
+        assert server.requests == 3
+    assert df["_id"].tolist() == raw["_id"].tolist()
+
+
+def test_sync_falls_back_to_full_fetch(raw, held):
+    # records held locally were removed upstream, so the counts no longer add up
+    reloaded = flag_latest(raw.iloc[: len(held) - 50])
+    with FixtureServer(reloaded) as server:
+        df = sync_data(RESOURCE_ID, held, server.url)
+    assert df["_id"].tolist() == reloaded["_id"].tolist()
+
+
+def test_sync_without_new_records(held):
+    with FixtureServer(held) as server:
+        df = sync_data(RESOURCE_ID, held, server.url)
+    assert df is held
@@ -0,0 +1,98 @@
+# Tests of the CKAN client against a local datastore injecting latency and errors
+
+import random
+import time
+import pytest
+import requests
+from benchmarks.ckan_fixture import FixtureServer, synthetic_frame
+from cityscore.ckan import fetch_data
+from cityscore.client import CircuitBreaker, CircuitOpenError, CkanClient, CkanError
+
+RESOURCE_ID = "dd657c02-3443-4c00-8b29-56a40cfe7ee4"
+PAGE_SIZE = 100
+
+
+@pytest.fixture(scope="module")
+def raw():
+    return synthetic_frame().iloc[:1000].reset_index(drop=True)
+
+
+def client_for(server, **kwargs):
+    """
+    Get a client with its own circuit breaker, backing off for next to no time
+    """
+    kwargs.setdefault("backoff_base", 0.001)
+    kwargs.setdefault("breaker", CircuitBreaker(failure_threshold=100))
+    return CkanClient(server.url, **kwargs)
+
+
+def test_retries_errors(raw):
+    random.seed(0)
+    with FixtureServer(raw, error_rate=0.3) as server:
+        with client_for(server, max_attempts=10) as client:
+            df = fetch_data(RESOURCE_ID, page_size=PAGE_SIZE, client=client)
+    assert df["_id"].tolist() == raw["_id"].tolist()
+    # every page was asked for at least once more
+    assert server.requests > len(raw) // PAGE_SIZE
+
+
+def test_circuit_opens_and_recovers(raw):
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=0.2)
+    with FixtureServer(raw, error_rate=1.0) as server:
+        with client_for(server, max_attempts=5, breaker=breaker) as client:
+            with pytest.raises(CircuitOpenError):
+                client.get("/api/3/action/datastore_search", {"resource_id": "x"})
+            assert server.requests == 3
+
+            # calls are rejected without reaching the API while the circuit is open
+            with pytest.raises(CircuitOpenError):
+                client.get("/api/3/action/datastore_search", {"resource_id": "x"})
+            assert server.requests == 3
+
+            # once the API is back, the trial call after reset_timeout closes it
+            server.error_rate = 0.0
+            time.sleep(0.25)
+            result, _ = client.get(
+                "/api/3/action/datastore_search", {"resource_id": "x", "limit": 1}
+            )
+            assert result["total"] == len(raw)
+            assert breaker.allow()
+
+
+def test_failed_trial_reopens_circuit(raw):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.2)
+    with FixtureServer(raw, error_rate=1.0) as server:
+        with client_for(server, max_attempts=1, breaker=breaker) as client:
+            with pytest.raises(CkanError):
+                client.get("/api/3/action/datastore_search", {"resource_id": "x"})
+            time.sleep(0.25)
+            with pytest.raises(CkanError):
+                client.get("/api/3/action/datastore_search", {"resource_id": "x"})
+            assert server.requests == 2
+            assert not breaker.allow()
+
+
+def test_times_out_slow_responses(raw):
+    with FixtureServer(raw, latency=1.0) as server:
+        with client_for(server, timeout=(1, 0.1), max_attempts=2) as client:
+            started = time.monotonic()
+            with pytest.raises(CkanError) as error:
+                client.get("/api/3/action/datastore_search", {"resource_id": "x"})
+            assert time.monotonic() - started < 1
+    assert isinstance(error.value.__cause__, requests.Timeout)
+
+
+class ShortServer(FixtureServer):
+    """
+    Datastore losing the records of every page after the first
+    """
+
+    def page(self, offset, limit):
+        return super().page(offset, limit) if offset == 0 else []
+
+
+def test_fetch_refuses_partial_frame(raw):
+    with ShortServer(raw) as server:
+        with client_for(server) as client:
+            with pytest.raises(CkanError, match=f"fetched {PAGE_SIZE} of {len(raw)}"):
+                fetch_data(RESOURCE_ID, page_size=PAGE_SIZE, client=client)
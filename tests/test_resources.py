@@ -0,0 +1,34 @@
+# Tests of building resources against a local datastore
+
+import pandas as pd
+from benchmarks.ckan_fixture import FixtureServer
+from cityscore.resources import METRIC_DEFINITIONS, build_resource
+
+
+def definitions_raw():
+    return pd.DataFrame(
+        {
+            "_id": [1, 2],
+            "Metric": ["Homicides", "Pothole On-Time %"],
+            "Description": ["Homicides reported", "Potholes repaired on time"],
+        }
+    )
+
+
+def test_edited_definition_is_picked_up():
+    raw = definitions_raw()
+    with FixtureServer(raw) as server:
+        first = build_resource(METRIC_DEFINITIONS, api_root=server.url)
+        assert (
+            first["definitions"].loc["HOMICIDES", "metric_description"]
+            == "Homicides reported"
+        )
+
+        # edited in place: the row count and the highest _id stay the same
+        raw.loc[0, "Description"] = "Homicides reported to the police"
+        second = build_resource(METRIC_DEFINITIONS, first, api_root=server.url)
+    assert second["etag"] != first["etag"]
+    assert (
+        second["definitions"].loc["HOMICIDES", "metric_description"]
+        == "Homicides reported to the police"
+    )